@@ -0,0 +1,149 @@
+import { spawn, type ChildProcessWithoutNullStreams } from "child_process";
+import { createInterface } from "readline";
+
+const ANALYZER_SCRIPT = "src/server/face_analyzer.py";
+const REQUEST_TIMEOUT_MS = 60_000;
+const MAX_RESTART_DELAY_MS = 10_000;
+
+interface WorkerResponse {
+  id: number | null;
+  result: any;
+}
+
+interface PendingRequest {
+  resolve: (result: any) => void;
+  reject: (error: Error) => void;
+  timer: ReturnType<typeof setTimeout>;
+}
+
+// Long-lived `face_analyzer.py --serve` process that keeps the insightface
+// models loaded. Requests and responses are newline-delimited JSON matched by
+// id, so several images can be in flight at once. If the process exits, every
+// pending request is rejected and the next call respawns it with backoff.
+export class AnalyzerWorker {
+  private child?: ChildProcessWithoutNullStreams;
+  private ready?: Promise<void>;
+  private pending = new Map<number, PendingRequest>();
+  private nextId = 1;
+  private restarts = 0;
+
+  constructor(
+    private pythonPath = "python3",
+    private concurrency = 2
+  ) {}
+
+  private start(): Promise<void> {
+    const delay = Math.min(
+      this.restarts === 0 ? 0 : 500 * 2 ** (this.restarts - 1),
+      MAX_RESTART_DELAY_MS
+    );
+
+    this.ready = new Promise<void>((resolve, reject) => {
+      setTimeout(() => {
+        const child = spawn(this.pythonPath, [
+          ANALYZER_SCRIPT,
+          "--serve",
+          "--workers",
+          String(this.concurrency),
+        ]);
+        this.child = child;
+
+        child.stderr.on("data", (chunk) => process.stderr.write(chunk));
+
+        createInterface({ input: child.stdout }).on("line", (line) => {
+          let message: WorkerResponse;
+          try {
+            message = JSON.parse(line);
+          } catch {
+            console.error("[AnalyzerWorker] Invalid frame:", line);
+            return;
+          }
+          if (message.id === null) {
+            if (message.result?.ready) {
+              this.restarts = 0;
+              resolve();
+            }
+            return;
+          }
+          const request = this.pending.get(message.id);
+          if (request) {
+            clearTimeout(request.timer);
+            this.pending.delete(message.id);
+            request.resolve(message.result);
+          }
+        });
+
+        // Spawn failures (e.g. python3 missing), EPIPE on stdin and exits all
+        // end this child; whichever comes first fails it exactly once
+        let failed = false;
+        const fail = (error: Error) => {
+          if (failed) return;
+          failed = true;
+          if (this.child === child) {
+            this.child = undefined;
+            this.ready = undefined;
+            this.restarts++;
+          }
+          for (const [id, request] of this.pending) {
+            clearTimeout(request.timer);
+            request.reject(error);
+            this.pending.delete(id);
+          }
+          reject(error);
+        };
+
+        child.on("error", (error) => {
+          console.error("[AnalyzerWorker] Worker error:", error.message);
+          fail(error);
+          child.kill();
+        });
+
+        child.stdin.on("error", (error) => {
+          console.error("[AnalyzerWorker] Worker stdin error:", error.message);
+          fail(error);
+          child.kill();
+        });
+
+        child.on("exit", (code, signal) => {
+          console.error(
+            `[AnalyzerWorker] Worker exited (code=${code}, signal=${signal})`
+          );
+          fail(new Error("Analyzer worker exited"));
+        });
+      }, delay);
+    });
+    return this.ready;
+  }
+
+  async analyze(imagePath: string): Promise<any> {
+    return this.request({ op: "analyze", path: imagePath });
+  }
+
+  async ping(): Promise<any> {
+    return this.request({ op: "ping" });
+  }
+
+  private async request(body: Record<string, unknown>): Promise<any> {
+    if (!this.ready) this.start();
+    await this.ready;
+
+    const child = this.child;
+    if (!child) throw new Error("Analyzer worker is not running");
+
+    const id = this.nextId++;
+    return new Promise((resolve, reject) => {
+      const timer = setTimeout(() => {
+        this.pending.delete(id);
+        reject(new Error(`Analyzer request ${id} timed out`));
+      }, REQUEST_TIMEOUT_MS);
+      this.pending.set(id, { resolve, reject, timer });
+      child.stdin.write(JSON.stringify({ id, ...body }) + "\n");
+    });
+  }
+
+  stop() {
+    this.child?.stdin.end();
+    this.child = undefined;
+    this.ready = undefined;
+  }
+}
@@ -1,14 +1,39 @@
-from fastapi import FastAPI, UploadFile, File
+from fastapi import FastAPI, UploadFile, File, Form, Body
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 import uvicorn
-from face_analyzer import analyze_face
-import tempfile
+from face_analyzer import ImageBuffers, analyze_image_bytes, load_analyzer
+from embedding_store import open_store
+from memory_budget import (
+    MAX_COMPARE_BYTES, MAX_UPLOAD_BYTES, MB, BodySizeLimitMiddleware, BodyTooLarge, InFlightLimiter, slots_for_budget
+)
+import batch_compare
 import os
 from typing import Dict, Any
-import json
 import asyncio
 app = FastAPI()
 
+UPLOAD_CHUNK_BYTES = 1 * MB
+
+# Models are loaded once and shared; images in flight are capped so the
+# process stays within MEMORY_BUDGET_MB, each with its own reusable buffers
+analyzer = load_analyzer()
+MEMORY_BUDGET_BYTES = int(os.environ.get("MEMORY_BUDGET_MB", "2048")) * MB
+limiter = InFlightLimiter(
+    ImageBuffers,
+    slots_for_budget(MEMORY_BUDGET_BYTES, ImageBuffers.nbytes_for())
+)
+print(f"[API] Memory budget {MEMORY_BUDGET_BYTES // MB} MB: {limiter.slots} images in flight")
+
+# Reject oversized bodies while they stream in; image uploads and JSON
+# embedding batches have separate limits
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    max_bytes=MAX_UPLOAD_BYTES,
+    paths=["/analyze-face", "/gallery/enroll", "/gallery/search"]
+)
+app.add_middleware(BodySizeLimitMiddleware, max_bytes=MAX_COMPARE_BYTES, paths=["/compare-embeddings"])
+
 # Configure CORS for Next.js development server
 app.add_middleware(
     CORSMiddleware,
@@ -18,85 +43,122 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+async def read_upload(file: UploadFile) -> bytearray:
+    """Read an upload in chunks, stopping as soon as it passes MAX_UPLOAD_BYTES."""
+    content = bytearray()
+    while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+        content.extend(chunk)
+        if len(content) > MAX_UPLOAD_BYTES:
+            raise BodyTooLarge(MAX_UPLOAD_BYTES)
+    # Returned without a bytes() copy; np.frombuffer reads a bytearray directly
+    return content
+
+async def embed_upload(file: UploadFile) -> Dict[str, Any]:
+    """Read, decode and analyze an uploaded image within the in-flight image cap."""
+    if not file.content_type or not file.content_type.startswith('image/'):
+        return {"error": "File must be an image"}
+
+    # The slot covers the upload buffer too, as counted by per_image_bytes
+    async with limiter.slot() as buffers:
+        content = await read_upload(file)
+        if not content:
+            return {"error": "Uploaded file is empty"}
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, analyze_image_bytes, content, analyzer, buffers)
+
 @app.post("/analyze-face")
 async def analyze_face_endpoint(file: UploadFile = File(...)) -> Dict[str, Any]:
     try:
         print(f"[API] Received file: {file.filename}, type: {file.content_type}, size: {file.size}")
         
-        # Ensure the file is an image
-        if not file.content_type.startswith('image/'):
-            print(f"[API] Invalid file type: {file.content_type}")
-            return {"error": "File must be an image"}
-
-        # Create a temporary file with proper extension
-        ext = file.content_type.split('/')[-1].lower()
-        if ext not in ['jpeg', 'jpg', 'png']:
-            ext = 'jpg'  # default to jpg if unknown format
-            
-        temp_file_path = None
-        try:
-            # Create temp file in binary write mode
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{ext}', mode='wb') as temp_file:
-                temp_file_path = temp_file.name
-                print(f"[API] Created temp file at: {temp_file_path}")
-                
-                # Read the entire file content at once and verify size
-                content = await file.read()
-                content_size = len(content)
-                print(f"[API] Read file content, size: {content_size} bytes")
-                
-                if content_size == 0:
-                    return {"error": "Uploaded file is empty"}
-                
-                temp_file.write(content)
-                temp_file.flush()
-                os.fsync(temp_file.fileno())
-
-            # Verify the temp file
-            if not os.path.exists(temp_file_path):
-                return {"error": "Failed to create temporary file"}
-                
-            temp_file_size = os.path.getsize(temp_file_path)
-            if temp_file_size == 0:
-                return {"error": "Temporary file is empty"}
-                
-            print(f"[API] Temp file verification:")
-            print(f"- Path: {temp_file_path}")
-            print(f"- Size: {temp_file_size} bytes")
-            print(f"- Readable: {os.access(temp_file_path, os.R_OK)}")
-            
-            # Debug information
-            print(f"[API] Temp file details:")
-            print(f"- Exists: {os.path.exists(temp_file_path)}")
-            print(f"- Size: {os.path.getsize(temp_file_path)} bytes")
-            print(f"- Permissions: {oct(os.stat(temp_file_path).st_mode)[-3:]}")
-            
-            # Analyze the face
-            print("[API] Calling face analyzer...")
-            result = analyze_face(temp_file_path)
-            print(f"[API] Face analysis result: {result[:200]}...")  # Print first 200 chars
-            
-            parsed_result = json.loads(result)
-            if "error" in parsed_result:
-                print(f"[API] Face analysis error: {parsed_result['error']}")
-                return {"error": parsed_result["error"]}
-            
-            return parsed_result
-            
-        finally:
-            if temp_file_path and os.path.exists(temp_file_path):
-                try:
-                    os.unlink(temp_file_path)
-                    print(f"[API] Cleaned up temp file: {temp_file_path}")
-                except Exception as e:
-                    print(f"[API] Error deleting temp file: {e}")
-                
+        result = await embed_upload(file)
+        if "error" in result:
+            print(f"[API] Face analysis error: {result['error']}")
+            return {"error": result["error"]}
+        
+        return result
+    
+    except BodyTooLarge:
+        raise
     except Exception as e:
         print(f"[API] Error processing image: {str(e)}")
         import traceback
         print(f"[API] Traceback: {traceback.format_exc()}")
         return {"error": str(e)}
 
+@app.post("/gallery/enroll")
+async def enroll_face_endpoint(file: UploadFile = File(...), person_id: str = Form(...)) -> Dict[str, Any]:
+    try:
+        result = await embed_upload(file)
+        if "error" in result:
+            return {"error": result["error"]}
+
+        added = open_store().add(person_id, result["embedding"], {"det_score": result["det_score"]})
+        if not added:
+            return {"error": f"Person {person_id} is already enrolled"}
+        return {"success": True, "person_id": person_id, "gallery_size": len(open_store())}
+    except BodyTooLarge:
+        raise
+    except Exception as e:
+        print(f"[API] Error enrolling face: {str(e)}")
+        return {"error": str(e)}
+
+@app.delete("/gallery/{person_id}")
+async def remove_face_endpoint(person_id: str) -> Dict[str, Any]:
+    if not open_store().delete(person_id):
+        return {"error": f"Person {person_id} is not enrolled"}
+    return {"success": True, "gallery_size": len(open_store())}
+
+@app.post("/gallery/search")
+async def search_gallery_endpoint(
+    file: UploadFile = File(...),
+    top_k: int = Form(5),
+    threshold: float = Form(0.5)
+) -> Dict[str, Any]:
+    try:
+        result = await embed_upload(file)
+        if "error" in result:
+            return {"error": result["error"]}
+
+        matches = open_store().search(result["embedding"], top_k=top_k, threshold=threshold)
+        return {"success": True, "matches": matches, "det_score": result["det_score"]}
+    except BodyTooLarge:
+        raise
+    except Exception as e:
+        print(f"[API] Error searching gallery: {str(e)}")
+        return {"error": str(e)}
+
+@app.post("/compare-embeddings")
+async def compare_embeddings_endpoint(payload: Dict[str, Any] = Body(...)):
+    """
+    1xN / NxM cosine similarity. Without "candidates" the queries are
+    compared against the enrolled gallery. See batch_compare.parse_request.
+    """
+    try:
+        request = batch_compare.parse_request(payload)
+        candidates, ids = request["candidates"], request["ids"]
+        from_store = candidates is None
+        if from_store:
+            ids, candidates = open_store().embeddings()
+            if len(ids) == 0:
+                return {"error": "Gallery is empty"}
+
+        # Store rows are already normalized, so the mapped matrix is used as-is
+        results = batch_compare.iter_results(
+            request["queries"], candidates,
+            top_k=request["top_k"], threshold=request["threshold"], ids=ids,
+            normalized=from_store
+        )
+        if request["stream"]:
+            # Starlette iterates sync generators in its threadpool
+            return StreamingResponse(batch_compare.ndjson_lines(results), media_type="application/x-ndjson")
+        loop = asyncio.get_running_loop()
+        return {"success": True, "results": await loop.run_in_executor(None, list, results)}
+    except Exception as e:
+        print(f"[API] Error comparing embeddings: {str(e)}")
+        return {"error": str(e)}
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
@@ -0,0 +1,142 @@
+import base64
+import json
+import numpy as np
+
+DTYPES = {"float32": np.float32, "float16": np.float16}
+CHUNK_ROWS = 256
+# Candidate rows converted to float32 at a time; float16 matmuls have no BLAS path
+BLOCK_ROWS = 8192
+
+
+def decode_embeddings(value, dim=None):
+    """
+    Decode embeddings from either a JSON list (one vector or a list of vectors)
+    or a compact binary form {"b64": <base64 bytes>, "dtype": "float32"|"float16",
+    "shape": [rows, dim]}. Returns a float32 matrix of shape (rows, dim).
+    """
+    if isinstance(value, dict):
+        dtype = value.get("dtype", "float32")
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported dtype: {dtype}")
+        matrix = np.frombuffer(base64.b64decode(value["b64"]), dtype=DTYPES[dtype])
+        shape = value.get("shape") or (-1, dim or matrix.size)
+        matrix = matrix.reshape(shape)
+    else:
+        matrix = np.asarray(value, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix[None, :]
+
+    if matrix.ndim != 2:
+        raise ValueError("Embeddings must be a vector or a matrix")
+    if dim is not None and matrix.shape[1] != dim:
+        raise ValueError(f"Expected {dim}-dimensional embeddings, got {matrix.shape[1]}")
+    return matrix.astype(np.float32)
+
+
+def encode_embeddings(matrix, dtype="float32"):
+    """Inverse of decode_embeddings for the binary form."""
+    matrix = np.ascontiguousarray(matrix, dtype=DTYPES[dtype])
+    return {"b64": base64.b64encode(matrix.tobytes()).decode("ascii"), "dtype": dtype, "shape": list(matrix.shape)}
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def similarity_matrix(queries, candidates):
+    """Cosine similarity of every query row against every candidate row, in one matrix product."""
+    return normalize_rows(queries) @ normalize_rows(candidates).T
+
+
+def select_matches(scores, top_k=None, threshold=None, ids=None):
+    """
+    Reduce one row of similarity scores to [{"index", "similarity"[, "id"]}],
+    best first, keeping at most top_k entries at or above threshold.
+    """
+    if threshold is not None:
+        candidates = np.flatnonzero(scores >= threshold)
+    else:
+        candidates = np.arange(len(scores))
+    if top_k is not None and top_k < len(candidates):
+        candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+    candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+
+    matches = []
+    for index in candidates:
+        match = {"index": int(index), "similarity": float(scores[index])}
+        if ids is not None:
+            match["id"] = ids[index]
+        matches.append(match)
+    return matches
+
+
+def block_scores(queries, candidates, block_rows=BLOCK_ROWS):
+    """
+    float32 queries @ candidates.T, converting the candidates to float32
+    block_rows at a time (a no-op view for float32 candidates).
+    """
+    scores = np.empty((len(queries), len(candidates)), dtype=np.float32)
+    for start in range(0, len(candidates), block_rows):
+        block = np.asarray(candidates[start:start + block_rows], dtype=np.float32)
+        scores[:, start:start + len(block)] = queries @ block.T
+    return scores
+
+
+def iter_results(queries, candidates, top_k=None, threshold=None, ids=None, chunk_rows=CHUNK_ROWS,
+                 normalized=False):
+    """
+    Yield one {"query", "matches"} result per query row, computing the
+    similarity matrix chunk_rows queries at a time so memory stays bounded
+    for large N x M comparisons. Pass normalized=True for candidates that are
+    already L2-normalized (e.g. an EmbeddingStore matrix) to use them as-is,
+    without a full float32 copy.
+    """
+    if not normalized:
+        candidates = normalize_rows(np.asarray(candidates, dtype=np.float32))
+    for start in range(0, len(queries), chunk_rows):
+        chunk = normalize_rows(np.asarray(queries[start:start + chunk_rows], dtype=np.float32))
+        scores = block_scores(chunk, candidates)
+        for offset, row in enumerate(scores):
+            yield {"query": start + offset, "matches": select_matches(row, top_k, threshold, ids)}
+
+
+def parse_request(payload):
+    """
+    Validate a batch comparison request body:
+      queries     embeddings (JSON or binary form), required
+      candidates  embeddings, optional when the caller supplies a gallery
+      ids         optional labels for the candidate rows
+      top_k       optional int
+      threshold   optional float
+      stream      optional bool, return newline-delimited JSON results
+    """
+    if "queries" not in payload:
+        raise ValueError("queries is required")
+    queries = decode_embeddings(payload["queries"])
+    candidates = None
+    if payload.get("candidates") is not None:
+        candidates = decode_embeddings(payload["candidates"], dim=queries.shape[1])
+
+    top_k = payload.get("top_k")
+    if top_k is not None and int(top_k) < 1:
+        raise ValueError("top_k must be positive")
+    threshold = payload.get("threshold")
+    ids = payload.get("ids")
+    if ids is not None and candidates is not None and len(ids) != len(candidates):
+        raise ValueError("ids must have one entry per candidate")
+
+    return {
+        "queries": queries,
+        "candidates": candidates,
+        "ids": ids,
+        "top_k": int(top_k) if top_k is not None else None,
+        "threshold": float(threshold) if threshold is not None else None,
+        "stream": bool(payload.get("stream", False)),
+    }
+
+
+def ndjson_lines(results):
+    for result in results:
+        yield json.dumps(result) + "\n"
@@ -0,0 +1,62 @@
+import { join } from "path";
+import { PythonShell } from "python-shell";
+import { AnalyzerWorker } from "./analyzer_worker";
+
+// Compares per-call latency of spawning face_analyzer.py for every image
+// (the old PythonShell path) against the persistent --serve worker.
+const RUNS = Number(process.env.BENCH_RUNS || 10);
+const imagePath = join(process.cwd(), "public", "images", "selfie.webp");
+
+async function spawnPerImage(path: string): Promise<any> {
+  // python-shell 5 returns a promise of the output lines
+  const output = await PythonShell.run("src/server/face_analyzer.py", {
+    args: [path],
+    pythonPath: "python3",
+  });
+  return output.length ? JSON.parse(output[0]) : {};
+}
+
+// Fail loudly instead of timing error responses
+async function checkEmbedding(label: string, result: Promise<any>) {
+  const output = await result;
+  if (!output?.embedding) {
+    throw new Error(`${label} returned no embedding: ${JSON.stringify(output)}`);
+  }
+}
+
+async function time(label: string, call: () => Promise<any>) {
+  const latencies: number[] = [];
+  for (let i = 0; i < RUNS; i++) {
+    const start = performance.now();
+    await call();
+    latencies.push(performance.now() - start);
+  }
+  latencies.sort((a, b) => a - b);
+  const mean = latencies.reduce((a, b) => a + b, 0) / latencies.length;
+  console.log(
+    `${label}: mean ${mean.toFixed(0)}ms, p50 ${latencies[
+      Math.floor(RUNS / 2)
+    ].toFixed(0)}ms, max ${latencies[RUNS - 1].toFixed(0)}ms`
+  );
+}
+
+async function benchAnalyzerBridge() {
+  await checkEmbedding("spawn per image", spawnPerImage(imagePath));
+  await time("spawn per image", () => spawnPerImage(imagePath));
+
+  const worker = new AnalyzerWorker();
+  const start = performance.now();
+  await worker.ping();
+  console.log(`worker startup: ${(performance.now() - start).toFixed(0)}ms`);
+  await checkEmbedding("persistent worker", worker.analyze(imagePath));
+  await time("persistent worker", () => worker.analyze(imagePath));
+  await time("persistent worker, 4 concurrent", () =>
+    Promise.all([1, 2, 3, 4].map(() => worker.analyze(imagePath)))
+  );
+  worker.stop();
+}
+
+benchAnalyzerBridge().catch((error) => {
+  console.error(error);
+  process.exit(1);
+});
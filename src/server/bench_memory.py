@@ -0,0 +1,94 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Sustained-load memory benchmark for app.py: starts the server, posts the
+# same image repeatedly from several client threads and samples the server's
+# RSS, reporting the steady-state level (median of the second half) and peak.
+
+def rss_mb(pid):
+    with open(f"/proc/{pid}/status", "r") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def wait_healthy(url, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{url}/health", timeout=1).ok:
+                return
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("Server did not become healthy")
+
+def run_benchmark(image_path, requests_total, concurrency, port, budget_mb):
+    env = {**os.environ, "MEMORY_BUDGET_MB": str(budget_mb)}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    samples = []
+    done = threading.Event()
+
+    def sample():
+        while not done.is_set():
+            samples.append(rss_mb(server.pid))
+            time.sleep(0.25)
+
+    try:
+        wait_healthy(url)
+        idle_mb = rss_mb(server.pid)
+        with open(image_path, "rb") as f:
+            image = f.read()
+
+        def post(_):
+            response = requests.post(f"{url}/analyze-face", files={"file": ("image.jpg", image, "image/jpeg")})
+            return response.ok and "error" not in response.json()
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            succeeded = sum(pool.map(post, range(requests_total)))
+        elapsed = time.time() - start
+        done.set()
+        sampler.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    steady = sorted(samples[len(samples) // 2:])
+    return {
+        "requests": requests_total,
+        "succeeded": succeeded,
+        "concurrency": concurrency,
+        "memory_budget_mb": budget_mb,
+        "requests_per_sec": round(requests_total / elapsed, 2),
+        "idle_rss_mb": round(idle_mb, 1),
+        "steady_rss_mb": round(steady[len(steady) // 2], 1) if steady else None,
+        "peak_rss_mb": round(max(samples), 1) if samples else None,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Steady-state RSS of app.py under sustained load")
+    parser.add_argument("image", help="Image to post repeatedly")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--budget-mb", type=int, default=2048)
+    args = parser.parse_args()
+
+    print(json.dumps(run_benchmark(args.image, args.requests, args.concurrency, args.port, args.budget_mb), indent=2))
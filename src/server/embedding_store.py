@@ -0,0 +1,366 @@
+import json
+import os
+import sys
+import threading
+import numpy as np
+
+HEADER_FILE = "header.json"
+DTYPES = {"float32": np.float32, "float16": np.float16}
+SEARCH_BLOCK_ROWS = 8192
+
+
+class EmbeddingStore:
+    """
+    Persistent, append-only store of face embeddings.
+
+    Layout on disk (inside `path`), per compaction generation:
+      - header.json                      dim, dtype and current generation;
+        rewritten only on compaction
+      - embeddings.<generation>.<dtype>  contiguous row-major matrix, one
+        L2-normalized embedding per row
+      - ids.<generation>.jsonl           one {"id", "metadata"} line per row
+      - deleted.<generation>.jsonl       one tombstoned row number per line
+
+    Inserts append to the matrix and the id log and deletes append to the
+    tombstone log, so a write costs O(batch), not O(gallery). Opening maps the
+    matrix without reading it and makes one line-by-line pass over the logs.
+
+    A row is committed once its id line is complete: matrix rows are fsynced
+    before id lines, and on open any matrix rows or partial log line past the
+    last complete id line are truncated. Compaction writes the next
+    generation's files and then swaps header.json atomically.
+
+    With read_only=True nothing on disk is created, repaired or removed:
+    uncommitted data is ignored instead of truncated, single rows are read
+    from the matrix file rather than kept mapped, and writes raise
+    ValueError. `is_stale` tells a cached reader when to reopen.
+    """
+
+    def __init__(self, path, dim=512, dtype="float32", compact_ratio=0.25, read_only=False):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported dtype: {dtype}")
+        self.path = path
+        self.compact_ratio = compact_ratio
+        self.read_only = read_only
+        self._lock = threading.RLock()
+        if not read_only:
+            os.makedirs(path, exist_ok=True)
+
+        header = self._read_header()
+        if header is not None:
+            self._header = header
+        else:
+            self._header = {"dim": dim, "dtype": dtype, "generation": 0}
+            if not read_only:
+                self._write_header()
+
+        self.dim = self._header["dim"]
+        self.dtype = DTYPES[self._header["dtype"]]
+        if not read_only:
+            self._remove_stale_generations()
+        self._disk_state = self._current_disk_state()
+
+        self._ids = []
+        self._metadata = []
+        for entry in self._read_log(self._ids_path()):
+            self._ids.append(entry["id"])
+            self._metadata.append(entry["metadata"])
+
+        # Id lines are written after their matrix rows, so this only trims damage
+        matrix_path = self._matrix_path()
+        matrix_rows = os.path.getsize(matrix_path) // self._row_bytes() if os.path.exists(matrix_path) else 0
+        if matrix_rows < len(self._ids):
+            print(f"[Store] Dropping {len(self._ids) - matrix_rows} id entries without matrix rows", file=sys.stderr)
+            del self._ids[matrix_rows:]
+            del self._metadata[matrix_rows:]
+            if not read_only:
+                self._rewrite_log(self._ids_path(), [
+                    {"id": row_id, "metadata": meta} for row_id, meta in zip(self._ids, self._metadata)
+                ])
+        if not read_only:
+            self._truncate_matrix(len(self._ids))
+
+        self._deleted = {row for row in self._read_log(self._deleted_path()) if row < len(self._ids)}
+        self._rows = {row_id: row for row, row_id in enumerate(self._ids) if row not in self._deleted}
+        self._map()
+        print(f"[Store] Opened {path}: {len(self)} embeddings, dim={self.dim}", file=sys.stderr)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, row_id):
+        return row_id in self._rows
+
+    @property
+    def ids(self):
+        """Live ids in row order."""
+        return [row_id for row, row_id in enumerate(self._ids) if row not in self._deleted]
+
+    def _file_path(self, prefix, suffix, generation=None):
+        if generation is None:
+            generation = self._header["generation"]
+        return os.path.join(self.path, f"{prefix}.{generation}.{suffix}")
+
+    def _matrix_path(self, generation=None):
+        return self._file_path("embeddings", self._header["dtype"], generation)
+
+    def _ids_path(self, generation=None):
+        return self._file_path("ids", "jsonl", generation)
+
+    def _deleted_path(self, generation=None):
+        return self._file_path("deleted", "jsonl", generation)
+
+    def _row_bytes(self):
+        return self.dim * np.dtype(self.dtype).itemsize
+
+    def _read_header(self):
+        header_path = os.path.join(self.path, HEADER_FILE)
+        if not os.path.exists(header_path):
+            return None
+        with open(header_path, "r") as f:
+            return json.load(f)
+
+    def _current_disk_state(self):
+        """Generation and log sizes; they change whenever another writer commits."""
+        header = self._read_header()
+        generation = header["generation"] if header is not None else None
+        sizes = []
+        for log_path in (self._ids_path(generation), self._deleted_path(generation)):
+            sizes.append(os.path.getsize(log_path) if generation is not None and os.path.exists(log_path) else 0)
+        return generation, tuple(sizes)
+
+    def is_stale(self):
+        """True if the files on disk have changed since this store read them (for read-only stores)."""
+        return self._current_disk_state() != self._disk_state
+
+    def _check_writable(self):
+        if self.read_only:
+            raise ValueError(f"Embedding store at {self.path} is read-only")
+
+    def _write_header(self):
+        header_path = os.path.join(self.path, HEADER_FILE)
+        temp_path = header_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self._header, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, header_path)
+
+    def _read_log(self, log_path):
+        """Parse complete lines of a jsonl log, truncating a partial last line left by a crash."""
+        if not os.path.exists(log_path):
+            return []
+        with open(log_path, "rb") as f:
+            data = f.read()
+        complete = data.rfind(b"\n") + 1
+        if complete < len(data) and not self.read_only:
+            print(f"[Store] Truncating partial line in {log_path}", file=sys.stderr)
+            with open(log_path, "r+b") as f:
+                f.truncate(complete)
+        return [json.loads(line) for line in data[:complete].splitlines() if line]
+
+    def _append_log(self, log_path, entries):
+        with open(log_path, "a") as f:
+            f.write("".join(json.dumps(entry) + "\n" for entry in entries))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _rewrite_log(self, log_path, entries):
+        temp_path = log_path + ".tmp"
+        with open(temp_path, "w") as f:
+            f.write("".join(json.dumps(entry) + "\n" for entry in entries))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, log_path)
+
+    def _truncate_matrix(self, rows):
+        matrix_path = self._matrix_path()
+        committed = rows * self._row_bytes()
+        if os.path.exists(matrix_path) and os.path.getsize(matrix_path) > committed:
+            print(f"[Store] Truncating uncommitted rows in {matrix_path}", file=sys.stderr)
+            with open(matrix_path, "r+b") as f:
+                f.truncate(committed)
+
+    def _remove_stale_generations(self):
+        current = {
+            os.path.basename(self._matrix_path()),
+            os.path.basename(self._ids_path()),
+            os.path.basename(self._deleted_path()),
+        }
+        for name in os.listdir(self.path):
+            if name.startswith(("embeddings.", "ids.", "deleted.")) and name not in current:
+                os.unlink(os.path.join(self.path, name))
+
+    def _map(self):
+        count = len(self._ids)
+        if count == 0:
+            self._matrix = np.empty((0, self.dim), dtype=self.dtype)
+        elif self.read_only:
+            # Mapped on first full-matrix use; single-row gets read the file directly
+            self._matrix = None
+        else:
+            self._matrix = np.memmap(self._matrix_path(), dtype=self.dtype, mode="r", shape=(count, self.dim))
+
+    def _mapped(self):
+        if self._matrix is None:
+            self._matrix = np.memmap(self._matrix_path(), dtype=self.dtype, mode="r",
+                                     shape=(len(self._ids), self.dim))
+        return self._matrix
+
+    def _read_row(self, row):
+        if self._matrix is not None:
+            return np.array(self._matrix[row], dtype=np.float32)
+        with open(self._matrix_path(), "rb") as f:
+            f.seek(row * self._row_bytes())
+            return np.frombuffer(f.read(self._row_bytes()), dtype=self.dtype).astype(np.float32)
+
+    def _normalize(self, embeddings):
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (embeddings / norms).astype(self.dtype)
+
+    def add(self, row_id, embedding, metadata=None):
+        """Append a single embedding. Returns False if the id is already stored."""
+        return self.add_many([row_id], [embedding], [metadata]) == 1
+
+    def add_many(self, row_ids, embeddings, metadata=None):
+        """
+        Append a batch of embeddings with one matrix fsync and one id log commit.
+        Ids that are already stored are skipped. Returns the number added.
+        """
+        self._check_writable()
+        if metadata is None:
+            metadata = [None] * len(row_ids)
+        with self._lock:
+            new_rows = []
+            seen = set()
+            for i, row_id in enumerate(row_ids):
+                if row_id in self._rows or row_id in seen:
+                    continue
+                seen.add(row_id)
+                new_rows.append(i)
+            if not new_rows:
+                return 0
+
+            matrix = self._normalize(embeddings)[new_rows]
+            with open(self._matrix_path(), "ab") as f:
+                f.write(np.ascontiguousarray(matrix).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self._append_log(self._ids_path(), [{"id": row_ids[i], "metadata": metadata[i]} for i in new_rows])
+
+            for i in new_rows:
+                self._rows[row_ids[i]] = len(self._ids)
+                self._ids.append(row_ids[i])
+                self._metadata.append(metadata[i])
+            self._map()
+            return len(new_rows)
+
+    def embeddings(self):
+        """Return (ids, matrix) of the live rows; the matrix is a view when nothing is deleted."""
+        if not self._deleted:
+            return list(self._ids), self._mapped()
+        keep = [row for row in range(len(self._ids)) if row not in self._deleted]
+        return [self._ids[row] for row in keep], self._mapped()[keep]
+
+    def get(self, row_id):
+        """Return (embedding, metadata) for an id, or None if it is not stored."""
+        row = self._rows.get(row_id)
+        if row is None:
+            return None
+        return self._read_row(row), self._metadata[row]
+
+    def delete(self, row_id):
+        """Tombstone an id. Compacts once the deleted fraction passes compact_ratio."""
+        self._check_writable()
+        with self._lock:
+            row = self._rows.pop(row_id, None)
+            if row is None:
+                return False
+            self._append_log(self._deleted_path(), [row])
+            self._deleted.add(row)
+            if len(self._deleted) > self.compact_ratio * len(self._ids):
+                self.compact()
+            return True
+
+    def compact(self):
+        """Rewrite the matrix and id log without tombstoned rows into a new generation."""
+        self._check_writable()
+        with self._lock:
+            if not self._deleted:
+                return
+            keep = [row for row in range(len(self._ids)) if row not in self._deleted]
+            old_files = [self._matrix_path(), self._ids_path(), self._deleted_path()]
+            generation = self._header["generation"] + 1
+
+            with open(self._matrix_path(generation), "wb") as f:
+                if keep:
+                    f.write(np.ascontiguousarray(self._matrix[keep]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            ids = [self._ids[row] for row in keep]
+            metadata = [self._metadata[row] for row in keep]
+            self._rewrite_log(self._ids_path(generation), [
+                {"id": row_id, "metadata": meta} for row_id, meta in zip(ids, metadata)
+            ])
+
+            # The header swap is the commit point; stale files are also removed on the next open
+            self._header = {**self._header, "generation": generation}
+            self._write_header()
+            self._ids = ids
+            self._metadata = metadata
+            self._deleted = set()
+            self._rows = {row_id: row for row, row_id in enumerate(ids)}
+            self._map()
+            for old_path in old_files:
+                if os.path.exists(old_path):
+                    os.unlink(old_path)
+            print(f"[Store] Compacted to generation {generation}: {len(keep)} embeddings", file=sys.stderr)
+
+    def search(self, query, top_k=5, threshold=None):
+        """
+        Cosine similarity of one query against every live row.
+        Returns a list of {"id", "similarity", "metadata"} sorted best first.
+        """
+        if len(self) == 0:
+            return []
+        query = np.asarray(query, dtype=np.float32).reshape(self.dim)
+        query = query / (np.linalg.norm(query) or 1.0)
+        # Scored in float32 blocks: numpy has no BLAS path for float16 products
+        matrix = self._mapped()
+        scores = np.empty(len(matrix), dtype=np.float32)
+        for start in range(0, len(matrix), SEARCH_BLOCK_ROWS):
+            block = np.asarray(matrix[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+            scores[start:start + len(block)] = block @ query
+        if self._deleted:
+            scores[list(self._deleted)] = -np.inf
+
+        top_k = min(top_k, len(self))
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        candidates = candidates[np.argsort(-scores[candidates])]
+
+        results = []
+        for row in candidates:
+            similarity = float(scores[row])
+            if threshold is not None and similarity < threshold:
+                break
+            results.append({
+                "id": self._ids[row],
+                "similarity": similarity,
+                "metadata": self._metadata[row],
+            })
+        return results
+
+
+_stores = {}
+
+
+def open_store(path=None, **kwargs):
+    """Open (or reuse) the process-wide store at `path`, defaulting to $EMBEDDING_STORE_DIR."""
+    if path is None:
+        path = os.environ.get("EMBEDDING_STORE_DIR", os.path.join(os.path.dirname(__file__), "data", "embeddings"))
+    path = os.path.abspath(path)
+    if path not in _stores:
+        _stores[path] = EmbeddingStore(path, **kwargs)
+    return _stores[path]
@@ -1,66 +1,147 @@
+import argparse
+import glob
 import sys
 import json
+import socketserver
+import threading
+import time
 import numpy as np
 import cv2
 import os
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+import onnxruntime
 from insightface.app import FaceAnalysis
-import gc
+from memory_budget import check_image_pixels, image_dimensions
 
-def analyze_face(image_path):
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+def load_analyzer(threads=None):
+    # Initialize with CPU provider and minimal memory usage
+    app = FaceAnalysis(
+        providers=['CPUExecutionProvider'],
+        # 2d106det fills face.landmark_2d_106, returned as 'landmarks'
+        allowed_modules=['detection', 'recognition', 'landmark_2d_106'],
+        det_size=(320, 320)  # Reduce detection size
+    )
+    if threads:
+        # FaceAnalysis does not forward session options, so rebuild each model's
+        # session with a bounded thread pool when several analyzers share the CPU
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        for model in app.models.values():
+            model.session = onnxruntime.InferenceSession(
+                model.model_file, sess_options=options, providers=['CPUExecutionProvider'])
+    app.prepare(ctx_id=-1)  # Force CPU usage
+    return app
+
+class ImageBuffers:
+    """
+    Preallocated resize and RGB buffers for one in-flight image, so a server
+    handling a stream of uploads reuses the same memory instead of allocating
+    two new frames per request. Not thread-safe: use one per concurrent image.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._resized = np.empty(max_size * max_size * 3, dtype=np.uint8)
+        self._rgb = np.empty(max_size * max_size * 3, dtype=np.uint8)
+
+    @staticmethod
+    def nbytes_for(max_size=1024):
+        """Memory held by one buffer set, without allocating it."""
+        return 2 * max_size * max_size * 3
+
+    def resized(self, shape):
+        return self._resized[:int(np.prod(shape))].reshape(shape)
+
+    def rgb(self, shape):
+        return self._rgb[:int(np.prod(shape))].reshape(shape)
+
+def fit_image(img, max_size=1024, buffers=None):
+    """Convert a decoded BGR image to RGB, downscaled so its longest side is at most max_size."""
+    if buffers is not None:
+        max_size = min(max_size, buffers.max_size)
+
+    # Resize image if too large
+    height, width = img.shape[:2]
+    if height > max_size or width > max_size:
+        scale = max_size / max(height, width)
+        size = (min(max_size, round(width * scale)), min(max_size, round(height * scale)))
+        dst = buffers.resized((size[1], size[0], 3)) if buffers is not None else None
+        img = cv2.resize(img, size, dst=dst)
+
+    # Convert to RGB
+    dst = buffers.rgb(img.shape) if buffers is not None else None
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=dst)
+
+def load_image(image_path, max_size=1024, buffers=None):
+    """Read an image file as RGB, downscaled so its longest side is at most max_size."""
+    if not os.path.isfile(image_path):
+        return None
+    with open(image_path, 'rb') as f:
+        return decode_image(f.read(), max_size, buffers)
+
+def decode_image(data, max_size=1024, buffers=None):
+    """
+    Decode encoded image bytes as RGB, downscaled so its longest side is at most
+    max_size. Raises ValueError for images over MAX_DECODED_PIXELS; the header
+    is checked first so an oversized frame is never allocated.
+    """
+    dimensions = image_dimensions(data)
+    if dimensions is not None:
+        check_image_pixels(*dimensions)
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    # Formats without a parsed header are checked after decoding
+    check_image_pixels(img.shape[1], img.shape[0])
+    return fit_image(img, max_size, buffers)
+
+def face_result(app, img):
+    """Result dict for the first face the analyzer finds in an RGB image."""
+    faces = app.get(img)
+    if not faces:
+        return {"error": "No faces detected"}
+
+    face = faces[0]
+    return {
+        'embedding': face.embedding.tolist(),
+        'landmarks': face.landmark_2d_106.tolist(),
+        'bbox': face.bbox.tolist(),
+        'det_score': float(face.det_score)
+    }
+
+def analyze_image_bytes(data, app, buffers=None):
+    """Analyze the first face in encoded image bytes with a loaded analyzer."""
+    try:
+        img = decode_image(data, buffers=buffers)
+        if img is None:
+            return {"error": "Failed to decode image"}
+        return face_result(app, img)
+    except Exception as e:
+        print(f"[Analyzer] Error: {str(e)}", file=sys.stderr)
+        return {"error": str(e)}
+
+def analyze_face_result(image_path, app=None):
+    """Analyze the first face in an image; pass a loaded analyzer to skip model loading."""
     try:
         print(f"[Analyzer] Starting face analysis for: {image_path}", file=sys.stderr)
         
-        # Initialize with CPU provider and minimal memory usage
-        app = FaceAnalysis(
-            providers=['CPUExecutionProvider'],
-            allowed_modules=['detection', 'recognition'],
-            det_size=(320, 320)  # Reduce detection size
-        )
-        app.prepare(ctx_id=-1)  # Force CPU usage
+        if app is None:
+            app = load_analyzer()
         
         # Read image with reduced size
-        img = cv2.imread(image_path)
+        img = load_image(image_path)
         if img is None:
-            return json.dumps({"error": "Failed to load image"})
-            
-        # Resize image if too large
-        max_size = 1024
-        height, width = img.shape[:2]
-        if height > max_size or width > max_size:
-            scale = max_size / max(height, width)
-            img = cv2.resize(img, None, fx=scale, fy=scale)
-            
-        # Convert to RGB
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        
-        # Detect faces
-        faces = app.get(img)
-        
-        # Clear memory
-        del img
-        gc.collect()
-        
-        if not faces:
-            return json.dumps({"error": "No faces detected"})
-            
-        face = faces[0]
-        result = {
-            'embedding': face.embedding.tolist(),
-            'landmarks': face.landmark_2d_106.tolist(),
-            'bbox': face.bbox.tolist(),
-            'det_score': float(face.det_score)
-        }
+            return {"error": "Failed to load image"}
         
-        # Clear more memory
-        del faces
-        del face
-        gc.collect()
-        
-        return json.dumps(result)
+        return face_result(app, img)
         
     except Exception as e:
         print(f"[Analyzer] Error: {str(e)}", file=sys.stderr)
-        return json.dumps({"error": str(e)})
+        return {"error": str(e)}
         
         # File verification checks with more detailed logging
         print(f"[Analyzer] File verification details:", file=sys.stderr)
@@ -71,16 +152,16 @@ def analyze_face(image_path):
         
         if not os.path.exists(image_path):
             print(f"[Analyzer] File does not exist: {image_path}", file=sys.stderr)
-            return json.dumps({"error": "File does not exist"})
+            return {"error": "File does not exist"}
             
         if not os.path.isfile(image_path):
             print(f"[Analyzer] Not a file: {image_path}", file=sys.stderr)
-            return json.dumps({"error": "Not a valid file"})
+            return {"error": "Not a valid file"}
             
         file_size = os.path.getsize(image_path)
         if file_size == 0:
             print(f"[Analyzer] Empty file: {image_path}", file=sys.stderr)
-            return json.dumps({"error": "File is empty"})
+            return {"error": "File is empty"}
             
         print(f"[Analyzer] File verification passed: {file_size} bytes", file=sys.stderr)
         
@@ -107,7 +188,7 @@ def analyze_face(image_path):
                 with open(image_path, 'rb') as f:
                     header = f.read(12)
                     print(f"[Analyzer] File header bytes: {header.hex()}", file=sys.stderr)
-                return json.dumps({"error": "Failed to decode image"})
+                return {"error": "Failed to decode image"}
             
             print(f"[Analyzer] Successfully decoded image: shape={img.shape}, dtype={img.dtype}", file=sys.stderr)
             
@@ -120,7 +201,7 @@ def analyze_face(image_path):
             print(f"[Analyzer] Error type: {type(e).__name__}", file=sys.stderr)
             import traceback
             print(f"[Analyzer] Image load traceback: {traceback.format_exc()}", file=sys.stderr)
-            return json.dumps({"error": f"Failed to load image: {str(e)}"})
+            return {"error": f"Failed to load image: {str(e)}"}
 
         # Detect faces
         print("[Analyzer] Detecting faces...", file=sys.stderr)
@@ -129,7 +210,7 @@ def analyze_face(image_path):
         
         if not faces:
             print("[Analyzer] No faces detected", file=sys.stderr)
-            return json.dumps({"error": "No faces detected in image"})
+            return {"error": "No faces detected in image"}
             
         face = faces[0]
         result = {
@@ -144,15 +225,219 @@ def analyze_face(image_path):
         print(f"- Landmarks points: {len(result['landmarks'])}", file=sys.stderr)
         print(f"- Detection score: {result['det_score']}", file=sys.stderr)
         
-        return json.dumps(result)
+        return result
         
     except Exception as e:
         print(f"[Analyzer] Error in analyze_face: {str(e)}", file=sys.stderr)
         import traceback
         print(f"[Analyzer] Traceback: {traceback.format_exc()}", file=sys.stderr)
-        return json.dumps({"error": str(e)})
+        return {"error": str(e)}
+
+def analyze_face(image_path, app=None):
+    return json.dumps(analyze_face_result(image_path, app))
+
+def collect_image_paths(inputs, manifest=None):
+    """Expand directories, globs and an optional manifest (one path per line) into image paths."""
+    if manifest:
+        with open(manifest, 'r') as f:
+            inputs = list(inputs) + [line.strip() for line in f if line.strip()]
+
+    paths = []
+    for entry in inputs:
+        if os.path.isdir(entry):
+            for root, _, files in os.walk(entry):
+                paths.extend(os.path.join(root, name) for name in sorted(files)
+                             if name.lower().endswith(IMAGE_EXTENSIONS))
+        elif glob.has_magic(entry):
+            paths.extend(sorted(glob.glob(entry, recursive=True)))
+        else:
+            paths.append(entry)
+    # Deduplicate while keeping input order
+    return list(dict.fromkeys(os.path.abspath(p) for p in paths))
+
+_worker_app = None
+
+def _init_batch_worker(threads):
+    global _worker_app
+    _worker_app = load_analyzer(threads)
+
+def _analyze_batch_item(image_path):
+    """Decode, detect and embed one image with the worker's warm model."""
+    try:
+        img = load_image(image_path)
+        if img is None:
+            return image_path, None, {"error": "Failed to load image"}
+        faces = _worker_app.get(img)
+        if not faces:
+            return image_path, None, {"error": "No faces detected"}
+        face = faces[0]
+        return image_path, face.embedding.astype(np.float32), {
+            'bbox': face.bbox.tolist(),
+            'det_score': float(face.det_score)
+        }
+    except Exception as e:
+        return image_path, None, {"error": str(e)}
+
+def analyze_batch(paths, output_dir, workers=None, commit_every=256):
+    """
+    Embed many images with a pool of warm-model workers and append the results
+    to an EmbeddingStore at output_dir (embeddings matrix + id log, keyed by
+    absolute path). Images that failed go to failures.jsonl. Paths already in
+    either are skipped, so an interrupted run resumes where it stopped. Each
+    worker's onnxruntime sessions get an equal share of the CPU cores.
+    """
+    from embedding_store import EmbeddingStore
+
+    store = EmbeddingStore(output_dir)
+    failures_path = os.path.join(output_dir, 'failures.jsonl')
+    failed = set()
+    if os.path.exists(failures_path):
+        with open(failures_path, 'r') as f:
+            failed = {json.loads(line)['path'] for line in f if line.strip()}
+
+    pending = [p for p in paths if p not in store and p not in failed]
+    print(f"[Analyzer] Batch: {len(paths)} images, {len(paths) - len(pending)} already done", file=sys.stderr)
+
+    stats = {"processed": 0, "enrolled": 0, "failed": 0}
+    start = time.time()
+    batch_ids, batch_embeddings, batch_metadata = [], [], []
+
+    def commit():
+        if batch_ids:
+            stats["enrolled"] += store.add_many(batch_ids, batch_embeddings, batch_metadata)
+            batch_ids.clear()
+            batch_embeddings.clear()
+            batch_metadata.clear()
+
+    workers = workers or os.cpu_count() or 1
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    with Pool(processes=workers, initializer=_init_batch_worker, initargs=(threads,)) as pool, \
+            open(failures_path, 'a') as failures:
+        try:
+            for image_path, embedding, info in pool.imap_unordered(_analyze_batch_item, pending, chunksize=4):
+                stats["processed"] += 1
+                if embedding is None:
+                    stats["failed"] += 1
+                    failures.write(json.dumps({"path": image_path, **info}) + "\n")
+                    failures.flush()
+                else:
+                    batch_ids.append(image_path)
+                    batch_embeddings.append(embedding)
+                    batch_metadata.append(info)
+                    if len(batch_ids) >= commit_every:
+                        commit()
+
+                if stats["processed"] % 100 == 0:
+                    rate = stats["processed"] / (time.time() - start)
+                    print(f"[Analyzer] {stats['processed']}/{len(pending)} images, {rate:.1f} images/sec", file=sys.stderr)
+        finally:
+            # Keep finished embeddings even when interrupted (e.g. Ctrl-C)
+            commit()
+
+    elapsed = time.time() - start
+    stats["seconds"] = round(elapsed, 2)
+    stats["images_per_sec"] = round(stats["processed"] / elapsed, 2) if elapsed > 0 else 0.0
+    return stats
+
+def handle_request(app, request):
+    """
+    Handle one worker request. Requests are JSON objects:
+      {"id": ..., "op": "analyze", "path": "/tmp/face.jpg"}
+      {"id": ..., "op": "ping"}
+    and each gets exactly one response {"id": ..., "result": {...}} with the
+    same id, in completion order rather than request order.
+    """
+    request_id = request.get("id")
+    op = request.get("op", "analyze")
+    if op == "ping":
+        return {"id": request_id, "result": {"pong": True, "pid": os.getpid()}}
+    if op == "analyze":
+        if not request.get("path"):
+            return {"id": request_id, "result": {"error": "path is required"}}
+        return {"id": request_id, "result": analyze_face_result(request["path"], app)}
+    return {"id": request_id, "result": {"error": f"Unknown op: {op}"}}
+
+def serve_lines(app, lines, write, workers=2):
+    """
+    Answer newline-delimited JSON requests from `lines` with a warm model,
+    running up to `workers` requests concurrently. `write` receives one
+    newline-terminated JSON response per request and is called under a lock.
+    """
+    lock = threading.Lock()
+
+    def respond(request):
+        try:
+            response = handle_request(app, request)
+        except Exception as e:
+            response = {"id": request.get("id"), "result": {"error": str(e)}}
+        with lock:
+            write(json.dumps(response) + "\n")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError:
+                with lock:
+                    write(json.dumps({"id": None, "result": {"error": "Invalid JSON request"}}) + "\n")
+                continue
+            pool.submit(respond, request)
+
+def serve_stdio(workers=2):
+    """Worker mode over stdin/stdout, used as a long-lived child process."""
+    # stdout carries only protocol frames; stray prints (e.g. insightface model loading) go to stderr
+    out = sys.stdout
+    sys.stdout = sys.stderr
+    app = load_analyzer()
+
+    def write(text):
+        out.write(text)
+        out.flush()
+
+    write(json.dumps({"id": None, "result": {"ready": True, "pid": os.getpid()}}) + "\n")
+
+    serve_lines(app, sys.stdin, write, workers)
+
+def serve_socket(socket_path, workers=2):
+    """Worker mode over a Unix socket; each connection speaks the same line protocol."""
+    app = load_analyzer()
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            def write(text):
+                self.wfile.write(text.encode())
+                self.wfile.flush()
+            serve_lines(app, (line.decode() for line in self.rfile), write, workers)
+
+    with socketserver.ThreadingUnixStreamServer(socket_path, Handler) as server:
+        print(f"[Analyzer] Worker listening on {socket_path}", file=sys.stderr)
+        server.serve_forever()
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
+    if len(sys.argv) == 2 and not sys.argv[1].startswith('-'):
         result = analyze_face(sys.argv[1])
-        print(result)  # Print to stdout for PythonShell to capture
\ No newline at end of file
+        print(result)  # Print to stdout for PythonShell to capture
+    elif len(sys.argv) > 1:
+        parser = argparse.ArgumentParser(description="Bulk offline face enrollment or long-lived analyzer worker")
+        parser.add_argument('inputs', nargs='*', help="Image files, directories or glob patterns")
+        parser.add_argument('--manifest', help="File listing one image path per line")
+        parser.add_argument('--output', help="Output embedding store directory")
+        parser.add_argument('--workers', type=int, default=None, help="Worker processes, or concurrent requests in worker mode")
+        parser.add_argument('--serve', action='store_true', help="Answer JSON-line requests on stdin/stdout with a warm model")
+        parser.add_argument('--socket', help="Answer JSON-line requests on this Unix socket with a warm model")
+        args = parser.parse_args()
+
+        if args.socket:
+            serve_socket(args.socket, workers=args.workers or 2)
+        elif args.serve:
+            serve_stdio(workers=args.workers or 2)
+        else:
+            if not args.output:
+                parser.error("--output is required for batch mode")
+            paths = collect_image_paths(args.inputs, args.manifest)
+            print(json.dumps(analyze_batch(paths, args.output, workers=args.workers)))
\ No newline at end of file
@@ -1,6 +1,9 @@
 import numpy as np
 from face_analyzer import analyze_face
+from embedding_store import open_store
+import hashlib
 import json
+import os
 
 def cosine_similarity(a, b):
     # Normalize vectors before computing similarity
@@ -8,18 +11,52 @@ def cosine_similarity(a, b):
     b_norm = b / np.linalg.norm(b)
     return np.dot(a_norm, b_norm)
 
-def compare_faces(image_paths):
+def image_key(image_path):
+    """Content-addressed store id for an image file."""
+    with open(image_path, 'rb') as f:
+        return "sha256:" + hashlib.sha256(f.read()).hexdigest()
+
+def get_embedding(image_path, store=None):
+    """
+    Return the face embedding for an image, reading it from the embedding
+    store when present and adding it to the store after analysis otherwise.
+    """
+    key = None
+    if store is not None and os.path.isfile(image_path):
+        key = image_key(image_path)
+        cached = store.get(key)
+        if cached is not None:
+            return cached[0]
+
+    result = json.loads(analyze_face(image_path))
+    if not result or 'embedding' not in result:
+        raise ValueError(f"Could not extract face embedding from {image_path}")
+    embedding = np.array(result['embedding'])
+
+    if key is not None:
+        store.add(key, embedding, {'source': image_path, 'det_score': result.get('det_score')})
+    return embedding
+
+def search_gallery(image_path, store, top_k=5, threshold=None):
+    """
+    1:N search of the face in an image against every embedding in the store.
+    Returns a list of {"id", "similarity", "metadata"} sorted best first.
+    """
+    embedding = get_embedding(image_path)
+    return store.search(embedding, top_k=top_k, threshold=threshold)
+
+def compare_faces(image_paths, store=None):
     """
     Compare three face images and determine which two are most likely the same person.
+    Embeddings are cached by image content in `store`, the process-wide
+    store from open_store() by default, so repeated images skip analysis.
     Returns tuple of (matching_pair_indices, similarity_score, all_similarities)
     """
+    if store is None:
+        store = open_store()
+
     # Get embeddings for all images
-    embeddings = []
-    for path in image_paths:
-        result = json.loads(analyze_face(path))
-        if not result or 'embedding' not in result:
-            raise ValueError(f"Could not extract face embedding from {path}")
-        embeddings.append(np.array(result['embedding']))
+    embeddings = [get_embedding(path, store) for path in image_paths]
     
     # Normalize embeddings
     embeddings = [emb / np.linalg.norm(emb) for emb in embeddings]
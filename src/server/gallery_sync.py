@@ -0,0 +1,367 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from embedding_store import open_store
+
+IPFS_GATEWAY = "https://gray-accepted-thrush-827.mypinata.cloud"
+
+# Event fragments matching contracts/PersonBounty.sol and contracts/FaceRegistry.sol
+EVENT_ABI = [
+    {
+        "type": "event",
+        "name": "PersonCreated",
+        "anonymous": False,
+        "inputs": [
+            {"name": "id", "type": "string", "indexed": True},
+            {"name": "ipfsHash", "type": "string", "indexed": False},
+        ],
+    },
+    {
+        "type": "event",
+        "name": "Registered",
+        "anonymous": False,
+        "inputs": [
+            {"name": "wallet", "type": "address", "indexed": True},
+            {"name": "faceHash", "type": "bytes32", "indexed": False},
+            {"name": "publicKey", "type": "bytes", "indexed": False},
+            {"name": "ipfsHash", "type": "string", "indexed": False},
+            {"name": "timestamp", "type": "uint256", "indexed": False},
+        ],
+    },
+]
+
+
+def event_store_id(event):
+    """Store id for a decoded PersonCreated / Registered event."""
+    args = event["args"]
+    if event["event"] == "PersonCreated":
+        # `id` is an indexed string, so only its keccak topic is recoverable from the log
+        return f"person:{args['id']}"
+    if event["event"] == "Registered":
+        return f"wallet:{args['wallet'].lower()}"
+    return None
+
+
+class Web3EventSource:
+    """Reads PersonCreated / Registered events from an EVM JSON-RPC endpoint."""
+
+    def __init__(self, rpc_url, addresses):
+        from web3 import Web3
+
+        self.w3 = Web3(Web3.HTTPProvider(rpc_url))
+        self.addresses = [Web3.to_checksum_address(a) for a in addresses]
+        self.contract = self.w3.eth.contract(abi=EVENT_ABI)
+        self.topics = {
+            Web3.keccak(text="PersonCreated(string,string)").hex(): self.contract.events.PersonCreated(),
+            Web3.keccak(text="Registered(address,bytes32,bytes,string,uint256)").hex(): self.contract.events.Registered(),
+        }
+
+    def block_number(self):
+        return self.w3.eth.block_number
+
+    def block_hash(self, number):
+        return self.w3.eth.get_block(number)["hash"].hex()
+
+    def events(self, from_block, to_block):
+        logs = self.w3.eth.get_logs({
+            "fromBlock": from_block,
+            "toBlock": to_block,
+            "address": self.addresses,
+            "topics": [list(self.topics)],
+        })
+        events = []
+        for log in logs:
+            decoder = self.topics.get(log["topics"][0].hex())
+            if decoder is None:
+                continue
+            decoded = decoder.process_log(log)
+            args = dict(decoded["args"])
+            if isinstance(args.get("id"), bytes):
+                args["id"] = args["id"].hex()
+            events.append({
+                "event": decoded["event"],
+                "args": args,
+                "block_number": log["blockNumber"],
+                "block_hash": log["blockHash"].hex(),
+                "log_index": log["logIndex"],
+            })
+        return events
+
+
+class RecordedEventSource:
+    """
+    Local chain stand-in replaying recorded blocks of events. Each block is
+    {"number", "hash", "events": [{"event", "args"}, ...]}; `reorg` replaces
+    the chain from a given height to simulate a fork.
+    """
+
+    def __init__(self, blocks):
+        self.blocks = {block["number"]: block for block in blocks}
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, "r") as f:
+            return cls(json.load(f))
+
+    def reorg(self, from_block, blocks):
+        self.blocks = {n: b for n, b in self.blocks.items() if n < from_block}
+        self.blocks.update({block["number"]: block for block in blocks})
+
+    def block_number(self):
+        return max(self.blocks) if self.blocks else 0
+
+    def block_hash(self, number):
+        return self.blocks[number]["hash"]
+
+    def events(self, from_block, to_block):
+        events = []
+        for number in range(from_block, to_block + 1):
+            block = self.blocks.get(number)
+            if block is None:
+                continue
+            for log_index, event in enumerate(block["events"]):
+                events.append({
+                    **event,
+                    "block_number": number,
+                    "block_hash": block["hash"],
+                    "log_index": log_index,
+                })
+        return events
+
+
+def fetch_ipfs_json(ipfs_hash):
+    import requests
+
+    response = requests.get(f"{IPFS_GATEWAY}/ipfs/{ipfs_hash}", headers={'Accept': 'application/json'}, timeout=30)
+    response.raise_for_status()
+    return response.json()
+
+
+class GallerySync:
+    """
+    Tails PersonCreated / Registered events into an EmbeddingStore.
+
+    Progress is checkpointed to a JSON file holding the last synced block,
+    the hashes and inserted ids of the most recent `reorg_depth` blocks, and
+    events whose IPFS document could not be fetched yet. On each sync the
+    stored hashes are checked against the chain; if a block was replaced, ids
+    inserted from the orphaned blocks are deleted and syncing resumes from the
+    common ancestor. Pending fetches are retried on every sync until they
+    succeed or their block is orphaned.
+    """
+
+    def __init__(self, source, store, checkpoint_path, start_block=0, batch_blocks=2000,
+                 reorg_depth=64, fetch_json=fetch_ipfs_json, fetch_workers=8):
+        self.source = source
+        self.store = store
+        self.checkpoint_path = checkpoint_path
+        self.batch_blocks = batch_blocks
+        self.reorg_depth = reorg_depth
+        self.fetch_json = fetch_json
+        self.fetch_workers = fetch_workers
+
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path, "r") as f:
+                checkpoint = json.load(f)
+        else:
+            checkpoint = {"block": start_block - 1, "hashes": {}, "inserted": {}, "pending": []}
+        self.block = checkpoint["block"]
+        self.hashes = {int(n): h for n, h in checkpoint["hashes"].items()}
+        self.inserted = {int(n): ids for n, ids in checkpoint["inserted"].items()}
+        self.pending = checkpoint.get("pending", [])
+
+    def _save_checkpoint(self):
+        temp_path = self.checkpoint_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"block": self.block, "hashes": self.hashes, "inserted": self.inserted,
+                       "pending": self.pending}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.checkpoint_path)
+
+    def _rollback_reorg(self):
+        """Undo any recent blocks that are no longer on the canonical chain."""
+        head = self.source.block_number()
+        orphaned = []
+        for number in sorted(self.hashes, reverse=True):
+            if number <= head and self.source.block_hash(number) == self.hashes[number]:
+                break
+            orphaned.append(number)
+        if not orphaned:
+            return 0
+
+        ancestor = min(orphaned) - 1
+        removed = 0
+        for number in orphaned:
+            for row_id in self.inserted.pop(number, []):
+                removed += self.store.delete(row_id)
+            self.hashes.pop(number)
+        self.pending = [entry for entry in self.pending if entry["block_number"] <= ancestor]
+        self.block = ancestor
+        self._save_checkpoint()
+        print(f"[Sync] Reorg detected: rolled back to block {ancestor}, removed {removed} embeddings", file=sys.stderr)
+        return removed
+
+    def _fetch_embeddings(self, to_fetch):
+        """Fetch {store_id: ipfs_hash} in parallel. Returns ({store_id: embedding}, {failed store_ids})."""
+        def fetch(item):
+            row_id, ipfs_hash = item
+            try:
+                return row_id, self.fetch_json(ipfs_hash).get("embedding")
+            except Exception as e:
+                print(f"[Sync] Failed to fetch IPFS {ipfs_hash}: {str(e)}", file=sys.stderr)
+                return row_id, None
+
+        embeddings = {}
+        failed = set()
+        if to_fetch:
+            with ThreadPoolExecutor(max_workers=self.fetch_workers) as pool:
+                for row_id, embedding in pool.map(fetch, to_fetch.items()):
+                    if embedding:
+                        embeddings[row_id] = embedding
+                    else:
+                        failed.add(row_id)
+        return embeddings, failed
+
+    def _ingest(self, entries, embeddings):
+        """Append fetched entries to the store, recording recent ones for reorg rollback."""
+        row_ids, rows, metadata = [], [], []
+        for entry in entries:
+            row_id = entry["id"]
+            if row_id not in embeddings or row_id in row_ids:
+                continue
+            row_ids.append(row_id)
+            rows.append(embeddings[row_id])
+            metadata.append({
+                "event": entry["event"],
+                "block_number": entry["block_number"],
+                "ipfs_hash": entry["ipfs_hash"],
+            })
+            if entry["block_number"] > self.block - self.reorg_depth:
+                self.inserted.setdefault(entry["block_number"], []).append(row_id)
+        return self.store.add_many(row_ids, rows, metadata) if row_ids else 0
+
+    def _inserted_by(self, row_id, event):
+        """True if the stored row for row_id came from this event's block."""
+        stored = self.store.get(row_id)
+        metadata = stored[1] if stored is not None else None
+        return bool(metadata) and metadata.get("block_number") == event["block_number"]
+
+    def _retry_pending(self):
+        """Retry IPFS fetches that failed on earlier syncs."""
+        if not self.pending:
+            return 0
+        self.pending = [entry for entry in self.pending if entry["id"] not in self.store]
+        embeddings, failed = self._fetch_embeddings({entry["id"]: entry["ipfs_hash"] for entry in self.pending})
+        added = self._ingest(self.pending, embeddings)
+        self.pending = [entry for entry in self.pending if entry["id"] in failed]
+        self._save_checkpoint()
+        print(f"[Sync] Retried pending fetches: {added} added, {len(self.pending)} still pending", file=sys.stderr)
+        return added
+
+    def sync_once(self):
+        """Ingest every event up to the current head. Returns the number of embeddings added."""
+        self._rollback_reorg()
+        added = self._retry_pending()
+        head = self.source.block_number()
+        while self.block < head:
+            from_block = self.block + 1
+            to_block = min(head, from_block + self.batch_blocks - 1)
+
+            # Pin the batch to one fork: a reorg at or below to_block changes its hash
+            anchor = self.source.block_hash(to_block)
+            events = self.source.events(from_block, to_block)
+            window = range(max(from_block, to_block - self.reorg_depth + 1), to_block + 1)
+            hashes = {event["block_number"]: event["block_hash"] for event in events
+                      if event["block_number"] in window}
+            # Only blocks without events need a lookup
+            for number in window:
+                if number not in hashes:
+                    hashes[number] = anchor if number == to_block else self.source.block_hash(number)
+            if hashes[to_block] != anchor or self.source.block_hash(to_block) != anchor:
+                print(f"[Sync] Chain changed while reading blocks {from_block}-{to_block}, retrying", file=sys.stderr)
+                self._rollback_reorg()
+                head = self.source.block_number()
+                continue
+
+            entries = []
+            embeddings = {}
+            for event in events:
+                row_id = event_store_id(event)
+                if row_id is None:
+                    continue
+                if row_id in self.store:
+                    # Replayed after a crash between the store commit and the
+                    # checkpoint: still track it so a reorg can roll it back
+                    if event["block_number"] in window and self._inserted_by(row_id, event):
+                        ids = self.inserted.setdefault(event["block_number"], [])
+                        if row_id not in ids:
+                            ids.append(row_id)
+                    continue
+                args = event["args"]
+                entries.append({
+                    "id": row_id,
+                    "event": event["event"],
+                    "block_number": event["block_number"],
+                    "ipfs_hash": args.get("ipfsHash"),
+                })
+                if args.get("embedding"):
+                    embeddings[row_id] = args["embedding"]
+            fetched, failed = self._fetch_embeddings({
+                entry["id"]: entry["ipfs_hash"] for entry in entries
+                if entry["id"] not in embeddings and entry["ipfs_hash"]
+            })
+            embeddings.update(fetched)
+
+            self.block = to_block
+            batch_added = self._ingest(entries, embeddings)
+            added += batch_added
+            pending_ids = {entry["id"] for entry in self.pending}
+            self.pending.extend(entry for entry in entries if entry["id"] in failed and entry["id"] not in pending_ids)
+
+            # Only the most recent blocks can be reorged, so only they are tracked
+            self.hashes.update(hashes)
+            cutoff = to_block - self.reorg_depth
+            for number in [n for n in self.hashes if n <= cutoff]:
+                self.hashes.pop(number)
+            for number in [n for n in self.inserted if n <= cutoff]:
+                self.inserted.pop(number)
+            self._save_checkpoint()
+            print(f"[Sync] Synced blocks {from_block}-{to_block}: {batch_added} embeddings, "
+                  f"{len(failed)} fetches pending", file=sys.stderr)
+        return added
+
+    def run(self, poll_interval=15):
+        while True:
+            try:
+                self.sync_once()
+            except Exception as e:
+                print(f"[Sync] Error: {str(e)}", file=sys.stderr)
+            time.sleep(poll_interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync the local face gallery from chain events")
+    parser.add_argument("--rpc-url", default=os.environ.get("RPC_URL", "https://testnet.evm.nodes.onflow.org"))
+    parser.add_argument("--address", action="append", required=True, help="PersonBounty / FaceRegistration address")
+    parser.add_argument("--start-block", type=int, default=0)
+    parser.add_argument("--checkpoint", default=os.path.join(os.path.dirname(__file__), "data", "sync_checkpoint.json"))
+    parser.add_argument("--store", default=None, help="Embedding store directory")
+    parser.add_argument("--poll-interval", type=float, default=15)
+    parser.add_argument("--once", action="store_true", help="Sync to the current head and exit")
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.checkpoint)), exist_ok=True)
+    sync = GallerySync(
+        Web3EventSource(args.rpc_url, args.address),
+        open_store(args.store),
+        args.checkpoint,
+        start_block=args.start_block,
+    )
+    if args.once:
+        print(json.dumps({"added": sync.sync_once(), "block": sync.block}))
+    else:
+        sync.run(args.poll_interval)
@@ -1,7 +1,7 @@
 import { readFile, writeFile, mkdir } from "fs/promises";
 import { dirname, join } from "path";
 import * as insightface from "@insightface/node";
-import { PythonShell } from "python-shell";
+import { AnalyzerWorker } from "./analyzer_worker";
 import { tmpdir } from "os";
 import { writeFile as writeFileTemp } from "fs/promises";
 import { join as joinPath } from "path";
@@ -200,29 +200,23 @@ const faceAnalyzer = await insightface.create({
   modelPath: "./models",
 });
 
+// Persistent face_analyzer.py worker, started on first use
+const analyzerWorker = new AnalyzerWorker();
+
 // Add export keyword to the function
 export async function extractBiometricMetadata(
   imageBuffer: Buffer
 ): Promise<BiometricMetadata> {
   try {
     // Save image to temp file
-    const tempPath = joinPath(tmpdir(), `face_${Date.now()}.jpg`);
+    const tempPath = joinPath(
+      tmpdir(),
+      `face_${Date.now()}_${Math.random().toString(36).slice(2)}.jpg`
+    );
     await writeFileTemp(tempPath, imageBuffer);
 
-    // Run Python script
-    const result = await new Promise((resolve, reject) => {
-      PythonShell.run(
-        "src/server/face_analyzer.py",
-        {
-          args: [tempPath],
-          pythonPath: "python3",
-        },
-        (err, output) => {
-          if (err) reject(err);
-          resolve(output ? JSON.parse(output[0]) : {});
-        }
-      );
-    });
+    // Analyze with the long-lived Python worker (models stay loaded between calls)
+    const result = await analyzerWorker.analyze(tempPath);
 
     // Create deterministic hash from face embedding
     const embedding = (result as any).embedding;
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import os
+import queue
+import struct
+from contextlib import asynccontextmanager
+from starlette.exceptions import HTTPException
+
+MB = 1024 * 1024
+
+# Upper bounds used to size the in-flight image cap from the memory budget
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_MB", "10")) * MB
+# JSON embedding batches are larger than a photo but never decoded as images
+MAX_COMPARE_BYTES = int(os.environ.get("MAX_COMPARE_MB", "64")) * MB
+MAX_DECODED_PIXELS = int(os.environ.get("MAX_DECODED_MEGAPIXELS", "24")) * 1_000_000
+MODEL_BYTES = 400 * MB  # detection + recognition sessions and their arenas
+INFERENCE_BYTES = 64 * MB  # per-image activations inside onnxruntime
+
+
+def image_dimensions(data):
+    """
+    (width, height) read from a JPEG, PNG, WebP or BMP header without decoding
+    the pixels, or None if the format is not recognised or the header is cut off.
+    """
+    try:
+        if data[:8] == b"\x89PNG\r\n\x1a\n":
+            return struct.unpack(">II", data[16:24])
+        if data[:2] == b"BM":
+            width, height = struct.unpack("<ii", data[18:26])
+            return width, abs(height)
+        if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+            chunk = data[12:16]
+            if chunk == b"VP8 ":
+                width, height = struct.unpack("<HH", data[26:30])
+                return width & 0x3FFF, height & 0x3FFF
+            if chunk == b"VP8L":
+                bits = struct.unpack("<I", data[21:25])[0]
+                return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+            if chunk == b"VP8X":
+                return (int.from_bytes(data[24:27], "little") + 1,
+                        int.from_bytes(data[27:30], "little") + 1)
+            return None
+        if data[:2] == b"\xff\xd8":
+            # Walk the marker segments up to the first start-of-frame
+            offset = 2
+            while offset + 9 <= len(data):
+                if data[offset] != 0xFF:
+                    return None
+                marker = data[offset + 1]
+                if marker == 0xFF:
+                    offset += 1
+                    continue
+                if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+                    # Standalone markers carry no length
+                    offset += 2
+                    continue
+                if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                    height, width = struct.unpack(">HH", data[offset + 5:offset + 9])
+                    return width, height
+                offset += 2 + struct.unpack(">H", data[offset + 2:offset + 4])[0]
+    except struct.error:
+        pass
+    return None
+
+
+def check_image_pixels(width, height, max_pixels=MAX_DECODED_PIXELS):
+    """Raise ValueError if a width x height image would decode past max_pixels."""
+    if width * height > max_pixels:
+        raise ValueError(f"Image {width}x{height} exceeds {max_pixels // 1_000_000} megapixel limit")
+
+
+def per_image_bytes(buffer_bytes):
+    """Worst-case memory one in-flight image holds: upload, decoded frame, reusable buffers, activations."""
+    return MAX_UPLOAD_BYTES + MAX_DECODED_PIXELS * 3 + buffer_bytes + INFERENCE_BYTES
+
+
+def slots_for_budget(budget_bytes, buffer_bytes):
+    """Number of images that can be in flight at once within budget_bytes."""
+    return max(1, (budget_bytes - MODEL_BYTES) // per_image_bytes(buffer_bytes))
+
+
+class InFlightLimiter:
+    """
+    Caps concurrent images and hands each one a preallocated buffer set.
+    Usage: `async with limiter.slot() as buffers: ...`
+    """
+
+    def __init__(self, make_buffers, slots):
+        self.slots = slots
+        self._semaphore = None
+        self._free = queue.SimpleQueue()
+        for _ in range(slots):
+            self._free.put(make_buffers())
+
+    @asynccontextmanager
+    async def slot(self):
+        # Created on first use so it binds to the server's event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.slots)
+        async with self._semaphore:
+            buffers = self._free.get_nowait()
+            try:
+                yield buffers
+            finally:
+                self._free.put(buffers)
+
+
+class BodyTooLarge(HTTPException):
+    # An HTTPException so FastAPI's body parsing re-raises it as a 413 instead of a 400
+    def __init__(self, max_bytes):
+        super().__init__(status_code=413, detail=f"Request body exceeds {max_bytes // MB} MB limit")
+
+
+class BodySizeLimitMiddleware:
+    """
+    ASGI middleware rejecting request bodies over max_bytes with 413. A
+    declared Content-Length is checked before any body is read; otherwise
+    bytes are counted as they stream in and the request is aborted as soon
+    as the limit is crossed, before the full upload is buffered. When
+    `paths` is given only requests to those paths are limited, so routes
+    with different body sizes can each get their own instance.
+    """
+
+    def __init__(self, app, max_bytes=MAX_UPLOAD_BYTES, paths=None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = set(paths) if paths is not None else None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (self.paths is not None and scope.get("path") not in self.paths):
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            return await self._reject(send)
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise BodyTooLarge(self.max_bytes)
+            return message
+
+        async def tracked_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except BodyTooLarge:
+            if not response_started:
+                await self._reject(send)
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": BodyTooLarge(self.max_bytes).detail}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -1,13 +1,17 @@
 import modal
-from fastapi import FastAPI, UploadFile, File, Form  # Added Form import
+from fastapi import FastAPI, UploadFile, File, Form, Body  # Added Form import
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 import numpy as np
 import cv2
 from insightface.app import FaceAnalysis
 from typing import Dict, Any, List
 import tempfile
+import asyncio
 import os
 import requests
+from embedding_store import EmbeddingStore
+import batch_compare
 
 # Create FastAPI app
 web_app = FastAPI()
@@ -24,6 +28,11 @@ web_app.add_middleware(
 # Create Modal app
 app = modal.App("face-analysis-api-v0.1")
 
+# Embedding store on a shared volume. Only store_ipfs_embedding writes to it;
+# readers open it read-only and reload the volume before each lookup.
+EMBEDDING_STORE_DIR = "/data/embeddings"
+volume = modal.Volume.from_name("face-embeddings", create_if_missing=True)
+
 # Create image with dependencies
 image = (
     modal.Image.debian_slim()
@@ -102,9 +111,9 @@ def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
     b_norm = b / np.linalg.norm(b)
     return float(np.dot(a_norm, b_norm))
 
+# A single dot product does not need a GPU
 @app.function(
     image=image,
-    gpu="T4",
     timeout=60
 )
 @modal.web_endpoint(method="post")
@@ -128,10 +137,119 @@ async def compare_embeddings(
     except Exception as e:
         return {"error": f"Embedding comparison failed: {str(e)}"}
 
+@app.function(
+    image=image,
+    timeout=300
+)
+@modal.web_endpoint(method="post")
+async def compare_embeddings_batch(payload: Dict[str, Any] = Body(...)):
+    """
+    1xN / NxM cosine similarity in one vectorized pass, CPU-only.
+    See batch_compare.parse_request for the request body.
+    """
+    try:
+        request = batch_compare.parse_request(payload)
+        if request["candidates"] is None:
+            return {"error": "candidates is required"}
+
+        results = batch_compare.iter_results(
+            request["queries"], request["candidates"],
+            top_k=request["top_k"], threshold=request["threshold"], ids=request["ids"]
+        )
+        if request["stream"]:
+            return StreamingResponse(batch_compare.ndjson_lines(results), media_type="application/x-ndjson")
+        loop = asyncio.get_running_loop()
+        return {"success": True, "results": await loop.run_in_executor(None, list, results)}
+
+    except Exception as e:
+        return {"error": f"Batch embedding comparison failed: {str(e)}"}
+
+_reader_store = None
+
+def reader_store() -> EmbeddingStore:
+    """
+    This container's read-only view of the shared store. The volume is
+    reloaded on every call, but the id log is only re-parsed when the writer
+    has committed a new generation or appended to the logs since.
+    """
+    global _reader_store
+    volume.reload()
+    if _reader_store is None or _reader_store.is_stale():
+        _reader_store = EmbeddingStore(EMBEDDING_STORE_DIR, read_only=True)
+    return _reader_store
+
+def fetch_ipfs_embedding(ipfs_hash: str) -> Dict[str, Any]:
+    """
+    Return {"embedding": ...} for an IPFS hash, from the embedding store when
+    present, otherwise fetched from the gateway and appended to the store.
+    On a failed fetch the returned dict carries "error" and "details".
+    """
+    cached = reader_store().get(f"ipfs:{ipfs_hash}")
+    if cached is not None:
+        print(f"[Modal] Using stored embedding for IPFS hash: {ipfs_hash}")
+        return {"embedding": cached[0]}
+
+    # Fetch IPFS content with detailed logging
+    ipfs_gateway = "https://gray-accepted-thrush-827.mypinata.cloud"  # Remove /ipfs from base URL
+    ipfs_url = f"{ipfs_gateway}/ipfs/{ipfs_hash}"  # Add /ipfs/ in the path
+    print(f"[Modal] Fetching IPFS content from: {ipfs_url}")
+
+    # Add headers for Pinata gateway
+    headers = {
+        'Accept': 'application/json',
+        'Usser-Agent': 'Modal-Face-Comparison/1.0'
+    }
+
+    ipfs_response = requests.get(ipfs_url, headers=headers)
+    print(f"[Modal] IPFS Response Status: {ipfs_response.status_code}")
+    print(f"[Modal] IPFS Response Headers: {dict(ipfs_response.headers)}")
+
+    if not ipfs_response.ok:
+        error_content = ipfs_response.text[:500]
+        print(f"[Modal] IPFS fetch failed with status {ipfs_response.status_code}")
+        print(f"[Modal] Error response content: {error_content}")
+        return {
+            "error": f"Failed to fetch IPFS content: {ipfs_response.status_code}",
+            "details": {
+                "status": ipfs_response.status_code,
+                "headers": dict(ipfs_response.headers),
+                "content": error_content
+            }
+        }
+
+    ipfs_data = ipfs_response.json()
+    print(f"[Modal] Successfully fetched IPFS data:")
+    print(f"- Has embedding: {'embedding' in ipfs_data}")
+    print(f"- Embedding length: {len(ipfs_data['embedding']) if 'embedding' in ipfs_data else 'N/A'}")
+
+    if 'embedding' in ipfs_data:
+        store_ipfs_embedding.spawn(ipfs_hash, ipfs_data['embedding'])
+    return ipfs_data
+
+@app.function(
+    image=image,
+    timeout=60,
+    volumes={"/data": volume},
+    concurrency_limit=1
+)
+def store_ipfs_embedding(ipfs_hash: str, embedding: List[float]):
+    """
+    Single writer for the shared embedding store. One container handles one
+    call at a time, so each append starts from the latest committed volume
+    and no two containers commit competing versions of the store files.
+    """
+    volume.reload()
+    store = EmbeddingStore(EMBEDDING_STORE_DIR)
+    added = store.add(f"ipfs:{ipfs_hash}", embedding, {"ipfs_hash": ipfs_hash})
+    del store
+    if added:
+        volume.commit()
+
 @app.function(
     image=image,
     gpu="T4",
-    timeout=60
+    timeout=60,
+    volumes={"/data": volume}
 )
 @modal.web_endpoint(method="post")
 async def compare_face_with_ipfs(
@@ -165,40 +283,10 @@ async def compare_face_with_ipfs(
             temp_files.append(temp_file.name)
             print(f"[Modal] Saved temp file: {temp_file.name}")
 
-        # Fetch IPFS content with detailed logging
-        ipfs_gateway = "https://gray-accepted-thrush-827.mypinata.cloud"  # Remove /ipfs from base URL
-        ipfs_url = f"{ipfs_gateway}/ipfs/{ipfs_hash}"  # Add /ipfs/ in the path
-        print(f"[Modal] Fetching IPFS content from: {ipfs_url}")
-        
-        # Add headers for Pinata gateway
-        headers = {
-            'Accept': 'application/json',
-            'Usser-Agent': 'Modal-Face-Comparison/1.0'
-        }
-        
-        ipfs_response = requests.get(ipfs_url, headers=headers)
-        print(f"[Modal] IPFS Response Status: {ipfs_response.status_code}")
-        print(f"[Modal] IPFS Response Headers: {dict(ipfs_response.headers)}")
-
-        if not ipfs_response.ok:
-            error_content = ipfs_response.text[:500]
-            print(f"[Modal] IPFS fetch failed with status {ipfs_response.status_code}")
-            print(f"[Modal] Error response content: {error_content}")
-            return {
-                "success": False,
-                "error": f"Failed to fetch IPFS content: {ipfs_response.status_code}",
-                "details": {
-                    "status": ipfs_response.status_code,
-                    "headers": dict(ipfs_response.headers),
-                    "content": error_content
-                }
-            }
+        ipfs_data = fetch_ipfs_embedding(ipfs_hash)
+        if "error" in ipfs_data:
+            return {"success": False, **ipfs_data}
 
-        ipfs_data = ipfs_response.json()
-        print(f"[Modal] Successfully fetched IPFS data:")
-        print(f"- Has embedding: {'embedding' in ipfs_data}")
-        print(f"- Embedding length: {len(ipfs_data['embedding']) if 'embedding' in ipfs_data else 'N/A'}")
-        
         # Initialize face analyzer
         analyzer = FaceAnalysis(name='buffalo_l')
         analyzer.prepare(ctx_id=0, det_size=(640, 640))
@@ -0,0 +1,92 @@
+import unittest
+import json
+import time
+import numpy as np
+import batch_compare
+
+class TestBatchCompare(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.candidates = rng.standard_normal((20, 512)).astype(np.float32)
+        self.queries = self.candidates[[3, 11]] + 0.1 * rng.standard_normal((2, 512)).astype(np.float32)
+
+    def test_decode_json_and_binary(self):
+        """Test both request encodings decode to the same matrix"""
+        from_json = batch_compare.decode_embeddings(self.queries.tolist())
+        from_binary = batch_compare.decode_embeddings(batch_compare.encode_embeddings(self.queries))
+        np.testing.assert_array_equal(from_json, from_binary)
+        self.assertEqual(batch_compare.decode_embeddings(self.queries[0].tolist()).shape, (1, 512))
+
+        half = batch_compare.decode_embeddings(batch_compare.encode_embeddings(self.queries, "float16"))
+        np.testing.assert_allclose(half, self.queries, atol=1e-2)
+
+        with self.assertRaises(ValueError):
+            batch_compare.decode_embeddings([[1.0, 2.0]], dim=512)
+
+    def test_matrix_matches_pairwise(self):
+        """Test the vectorized matrix agrees with one-pair cosine similarity"""
+        scores = batch_compare.similarity_matrix(self.queries, self.candidates)
+        self.assertEqual(scores.shape, (2, 20))
+        a, b = self.queries[1], self.candidates[5]
+        expected = np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+        self.assertAlmostEqual(float(scores[1, 5]), float(expected), places=5)
+
+    def test_top_k_and_threshold(self):
+        """Test server-side top-k and threshold filtering"""
+        ids = [f"person{i}" for i in range(20)]
+        results = list(batch_compare.iter_results(self.queries, self.candidates, top_k=3, ids=ids, chunk_rows=1))
+        self.assertEqual([r["query"] for r in results], [0, 1])
+        self.assertEqual(results[0]["matches"][0]["id"], "person3")
+        self.assertEqual(results[1]["matches"][0]["index"], 11)
+        self.assertEqual(len(results[0]["matches"]), 3)
+
+        results = list(batch_compare.iter_results(self.queries, self.candidates, threshold=0.9))
+        self.assertEqual([[m["index"] for m in r["matches"]] for r in results], [[3], [11]])
+
+    def test_prenormalized_candidates(self):
+        """Test store-normalized candidates are used as-is, including float16 rows"""
+        expected = list(batch_compare.iter_results(self.queries, self.candidates, top_k=3))
+        unit = batch_compare.normalize_rows(self.candidates)
+        self.assertEqual(list(batch_compare.iter_results(self.queries, unit, top_k=3, normalized=True)), expected)
+
+        half = list(batch_compare.iter_results(self.queries, unit.astype(np.float16), top_k=3, normalized=True))
+        self.assertEqual([[m["index"] for m in r["matches"]] for r in half],
+                         [[m["index"] for m in r["matches"]] for r in expected])
+
+    def test_float16_candidates_score_in_float32(self):
+        """Test float16 candidates are scored with float32 products, not numpy's slow float16 matmul"""
+        rng = np.random.default_rng(1)
+        queries = rng.standard_normal((64, 512)).astype(np.float32)
+        unit = batch_compare.normalize_rows(rng.standard_normal((5000, 512)).astype(np.float32))
+        half = unit.astype(np.float16)
+
+        scores = batch_compare.block_scores(batch_compare.normalize_rows(queries), half, block_rows=1000)
+        self.assertEqual(scores.dtype, np.float32)
+        np.testing.assert_allclose(scores, batch_compare.normalize_rows(queries) @ unit.T, atol=2e-3)
+
+        def timed(candidates):
+            start = time.perf_counter()
+            list(batch_compare.iter_results(queries, candidates, top_k=1, normalized=True))
+            return time.perf_counter() - start
+        # A float16 product is ~100x slower; block conversion keeps it within a small factor
+        self.assertLess(timed(half), 10 * timed(unit) + 0.05)
+
+    def test_parse_request_and_stream(self):
+        """Test request validation and newline-delimited JSON output"""
+        request = batch_compare.parse_request({
+            "queries": batch_compare.encode_embeddings(self.queries),
+            "candidates": self.candidates.tolist(),
+            "top_k": 1,
+        })
+        lines = list(batch_compare.ndjson_lines(batch_compare.iter_results(
+            request["queries"], request["candidates"], top_k=request["top_k"])))
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[1])["matches"][0]["index"], 11)
+
+        with self.assertRaises(ValueError):
+            batch_compare.parse_request({"candidates": []})
+        with self.assertRaises(ValueError):
+            batch_compare.parse_request({"queries": [[1.0]], "top_k": 0})
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,166 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from embedding_store import EmbeddingStore
+
+class TestEmbeddingStore(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.rng = np.random.default_rng(0)
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def random_embeddings(self, count, dim=512):
+        return self.rng.standard_normal((count, dim)).astype(np.float32)
+
+    def test_add_and_reopen(self):
+        """Test that appended embeddings survive reopening the store"""
+        embeddings = self.random_embeddings(3)
+        store = EmbeddingStore(self.path)
+        self.assertEqual(store.add_many(["a", "b", "c"], embeddings, [{"n": 1}, {"n": 2}, {"n": 3}]), 3)
+        self.assertFalse(store.add("a", embeddings[0]), "Duplicate ids should be skipped")
+
+        reopened = EmbeddingStore(self.path)
+        self.assertEqual(len(reopened), 3)
+        embedding, metadata = reopened.get("b")
+        expected = embeddings[1] / np.linalg.norm(embeddings[1])
+        np.testing.assert_allclose(embedding, expected, rtol=1e-5)
+        self.assertEqual(metadata, {"n": 2})
+
+    def test_search_ranks_closest_first(self):
+        """Test 1:N search ordering and threshold filtering"""
+        embeddings = self.random_embeddings(50)
+        store = EmbeddingStore(self.path)
+        store.add_many([str(i) for i in range(50)], embeddings)
+
+        probe = embeddings[7] + 0.1 * self.random_embeddings(1)[0]
+        results = store.search(probe, top_k=3)
+        self.assertEqual(results[0]["id"], "7")
+        self.assertEqual(len(results), 3)
+        self.assertGreaterEqual(results[0]["similarity"], results[1]["similarity"])
+
+        filtered = store.search(probe, top_k=3, threshold=0.9)
+        self.assertEqual([r["id"] for r in filtered], ["7"])
+
+    def test_delete_and_compact(self):
+        """Test tombstoned ids are hidden and removed by compaction"""
+        embeddings = self.random_embeddings(10)
+        store = EmbeddingStore(self.path, compact_ratio=0.5)
+        store.add_many([str(i) for i in range(10)], embeddings)
+
+        self.assertTrue(store.delete("3"))
+        self.assertIsNone(store.get("3"))
+        self.assertNotIn("3", [r["id"] for r in store.search(embeddings[3], top_k=10)])
+
+        store.compact()
+        reopened = EmbeddingStore(self.path)
+        self.assertEqual(len(reopened), 9)
+        self.assertEqual(reopened.search(embeddings[4], top_k=1)[0]["id"], "4")
+        matrices = [name for name in os.listdir(self.path) if name.startswith("embeddings.")]
+        self.assertEqual(matrices, ["embeddings.1.float32"])
+
+    def test_readd_after_delete_survives_reopen(self):
+        """Test an id deleted and then re-added is live after reopening"""
+        embeddings = self.random_embeddings(4)
+        store = EmbeddingStore(self.path, compact_ratio=1.0)
+        store.add_many(["a", "b", "c"], embeddings[:3])
+        store.delete("b")
+        self.assertTrue(store.add("b", embeddings[3]))
+
+        reopened = EmbeddingStore(self.path, compact_ratio=1.0)
+        self.assertIn("b", reopened)
+        self.assertEqual(len(reopened), 3)
+        embedding, _ = reopened.get("b")
+        np.testing.assert_allclose(embedding, embeddings[3] / np.linalg.norm(embeddings[3]), rtol=1e-5)
+        self.assertFalse(reopened.add("b", embeddings[3]), "Re-adding a live id should be skipped")
+        self.assertEqual(reopened.ids.count("b"), 1)
+
+    def test_uncommitted_rows_are_discarded(self):
+        """Test that rows written without an index commit are dropped on open"""
+        store = EmbeddingStore(self.path)
+        store.add("a", self.random_embeddings(1)[0])
+        with open(os.path.join(self.path, "embeddings.0.float32"), "ab") as f:
+            f.write(b"\x00" * 100)
+
+        reopened = EmbeddingStore(self.path)
+        self.assertEqual(len(reopened), 1)
+        self.assertEqual(os.path.getsize(os.path.join(self.path, "embeddings.0.float32")), 512 * 4)
+
+    def test_writes_append_to_logs(self):
+        """Test inserts and deletes append one line each and leave the header alone"""
+        embeddings = self.random_embeddings(3)
+        store = EmbeddingStore(self.path, compact_ratio=1.0)
+        header_path = os.path.join(self.path, "header.json")
+        header_mtime = os.stat(header_path).st_mtime_ns
+
+        store.add_many(["a", "b"], embeddings[:2])
+        store.add("c", embeddings[2])
+        store.delete("a")
+        with open(os.path.join(self.path, "ids.0.jsonl")) as f:
+            self.assertEqual(len(f.readlines()), 3)
+        with open(os.path.join(self.path, "deleted.0.jsonl")) as f:
+            self.assertEqual(f.read(), "0\n")
+        self.assertEqual(os.stat(header_path).st_mtime_ns, header_mtime)
+
+    def test_partial_id_line_is_discarded(self):
+        """Test a torn id log write drops the uncommitted row and its matrix data"""
+        embeddings = self.random_embeddings(2)
+        store = EmbeddingStore(self.path)
+        store.add("a", embeddings[0])
+        with open(os.path.join(self.path, "embeddings.0.float32"), "ab") as f:
+            f.write(embeddings[1].tobytes())
+        with open(os.path.join(self.path, "ids.0.jsonl"), "a") as f:
+            f.write('{"id": "b", "meta')
+
+        reopened = EmbeddingStore(self.path)
+        self.assertEqual(reopened.ids, ["a"])
+        self.assertEqual(os.path.getsize(os.path.join(self.path, "embeddings.0.float32")), 512 * 4)
+        self.assertTrue(reopened.add("b", embeddings[1]))
+        self.assertEqual(EmbeddingStore(self.path).ids, ["a", "b"])
+
+    def test_read_only_reader(self):
+        """Test a read-only open never touches the files and notices the writer's commits"""
+        embeddings = self.random_embeddings(3)
+        self.assertEqual(len(EmbeddingStore(os.path.join(self.path, "missing"), read_only=True)), 0)
+        self.assertFalse(os.path.exists(os.path.join(self.path, "missing")))
+
+        writer = EmbeddingStore(self.path, compact_ratio=1.0)
+        writer.add_many(["a", "b"], embeddings[:2])
+        ids_path = os.path.join(self.path, "ids.0.jsonl")
+        with open(ids_path, "a") as f:
+            f.write('{"id": "c"')
+        snapshot = {name: os.path.getsize(os.path.join(self.path, name)) for name in os.listdir(self.path)}
+
+        reader = EmbeddingStore(self.path, read_only=True)
+        self.assertEqual(reader.ids, ["a", "b"])
+        np.testing.assert_allclose(reader.get("b")[0], embeddings[1] / np.linalg.norm(embeddings[1]), rtol=1e-5)
+        self.assertEqual(reader.search(embeddings[0], top_k=1)[0]["id"], "a")
+        self.assertEqual({name: os.path.getsize(os.path.join(self.path, name)) for name in os.listdir(self.path)},
+                         snapshot, "Read-only open must not repair or clean up files")
+        with self.assertRaises(ValueError):
+            reader.add("c", embeddings[2])
+        self.assertFalse(reader.is_stale())
+
+        writer = EmbeddingStore(self.path, compact_ratio=1.0)
+        writer.add("c", embeddings[2])
+        self.assertTrue(reader.is_stale())
+        reader = EmbeddingStore(self.path, read_only=True)
+        writer.delete("a")
+        writer.compact()
+        self.assertTrue(reader.is_stale())
+        self.assertEqual(EmbeddingStore(self.path, read_only=True).ids, ["b", "c"])
+
+    def test_float16_storage(self):
+        """Test half-precision storage round-trips within tolerance"""
+        embeddings = self.random_embeddings(2)
+        store = EmbeddingStore(self.path, dtype="float16")
+        store.add_many(["a", "b"], embeddings)
+        embedding, _ = EmbeddingStore(self.path).get("a")
+        expected = embeddings[0] / np.linalg.norm(embeddings[0])
+        np.testing.assert_allclose(embedding, expected, atol=1e-3)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
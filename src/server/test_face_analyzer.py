@@ -2,8 +2,14 @@ import unittest
 import json
 import os
 import warnings
+import shutil
+import tempfile
 import numpy as np
-from face_analyzer import analyze_face
+import cv2
+from embedding_store import EmbeddingStore
+from face_analyzer import (
+    analyze_face, analyze_image_bytes, collect_image_paths, analyze_batch, decode_image, load_analyzer, serve_lines
+)
 
 class TestFaceAnalyzer(unittest.TestCase):
     @classmethod
@@ -68,5 +74,73 @@ class TestFaceAnalyzer(unittest.TestCase):
         result_dict = json.loads(result)
         self.assertEqual(result_dict, {}, "Should return empty dict for invalid image")
 
+    def test_oversized_image_is_rejected(self):
+        """Test images past the decoded pixel limit are refused from the header, before decoding"""
+        encoded = bytearray(cv2.imencode('.png', np.zeros((8, 8, 3), dtype=np.uint8))[1].tobytes())
+        self.assertEqual(decode_image(bytes(encoded)).shape, (8, 8, 3))
+        self.assertEqual(decode_image(encoded).shape, (8, 8, 3), "Uploads are passed as a bytearray")
+
+        # Claim 50000x50000 in the PNG header; the pixel data is never read
+        encoded[16:24] = (50000).to_bytes(4, 'big') * 2
+        with self.assertRaises(ValueError):
+            decode_image(bytes(encoded))
+        result = analyze_image_bytes(bytes(encoded), app=None)
+        self.assertIn("megapixel limit", result["error"])
+
+    def test_collect_image_paths(self):
+        """Test expansion of directories, globs and manifests into image paths"""
+        temp_dir = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(temp_dir, "sub"))
+            for name in ["a.jpg", "b.txt", os.path.join("sub", "c.png")]:
+                open(os.path.join(temp_dir, name), 'wb').close()
+            manifest = os.path.join(temp_dir, "manifest.txt")
+            with open(manifest, 'w') as f:
+                f.write(os.path.join(temp_dir, "a.jpg") + "\n\n")
+
+            from_dir = collect_image_paths([temp_dir])
+            self.assertEqual(from_dir, [os.path.join(temp_dir, "a.jpg"), os.path.join(temp_dir, "sub", "c.png")])
+            self.assertEqual(collect_image_paths([os.path.join(temp_dir, "*.jpg")], manifest),
+                             [os.path.join(temp_dir, "a.jpg")])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_batch_analysis_resumes(self):
+        """Test bulk enrollment output and that a second run skips finished images"""
+        output_dir = tempfile.mkdtemp()
+        try:
+            valid, missing = os.path.abspath(self.test_image_path), os.path.abspath("nonexistent_image.jpg")
+            stats = analyze_batch([valid, missing], output_dir, workers=1)
+            self.assertEqual(stats["processed"], 2)
+            self.assertEqual(stats["enrolled"], 1)
+            self.assertEqual(stats["failed"], 1)
+            self.assertEqual(EmbeddingStore(output_dir).ids, [valid])
+            with open(os.path.join(output_dir, "failures.jsonl")) as f:
+                self.assertEqual([json.loads(line)["path"] for line in f], [missing])
+
+            stats = analyze_batch([valid, missing], output_dir, workers=1)
+            self.assertEqual(stats["processed"], 0, "Second run should resume with nothing left")
+        finally:
+            shutil.rmtree(output_dir)
+
+    def test_worker_protocol(self):
+        """Test the worker answers every framed request once, matched by id"""
+        requests = [
+            json.dumps({"id": 1, "op": "ping"}),
+            json.dumps({"id": 2, "op": "analyze", "path": self.test_image_path}),
+            "not json",
+            json.dumps({"id": 3, "op": "analyze"}),
+        ]
+        output = []
+        serve_lines(load_analyzer(), requests, output.append, workers=2)
+        responses = {r["id"]: r["result"] for r in map(json.loads, output)}
+
+        self.assertEqual(len(output), 4)
+        self.assertTrue(responses[1]["pong"])
+        self.assertEqual(len(responses[2]["embedding"]), 512, responses[2].get("error"))
+        self.assertEqual(len(responses[2]["landmarks"]), 106)
+        self.assertIn("error", responses[3])
+        self.assertIn("error", responses[None])
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
\ No newline at end of file
@@ -1,7 +1,13 @@
 import unittest
+import json
 import os
+import shutil
+import tempfile
 import warnings
-from face_comparison import compare_faces
+from unittest import mock
+import numpy as np
+from embedding_store import EmbeddingStore
+from face_comparison import compare_faces, search_gallery
 
 class TestFaceComparison(unittest.TestCase):
     @classmethod
@@ -101,5 +107,53 @@ class TestFaceComparison(unittest.TestCase):
             print(f"Same person pair {pair}: {score:.4f}")
             self.assertGreaterEqual(score, 0.5, f"Low similarity for same person: {score}")
 
+    def test_store_reuses_embeddings(self):
+        """Test a repeated comparison reads embeddings from the store instead of re-analyzing"""
+        temp_dir = tempfile.mkdtemp()
+        try:
+            rng = np.random.default_rng(0)
+            vectors = {}
+            image_paths = []
+            for i in range(3):
+                path = os.path.join(temp_dir, f"face{i}.jpg")
+                with open(path, 'wb') as f:
+                    f.write(f"image {i}".encode())
+                vectors[path] = rng.standard_normal(512).tolist()
+                image_paths.append(path)
+            store = EmbeddingStore(os.path.join(temp_dir, "store"))
+
+            def fake_analyze(path):
+                return json.dumps({"embedding": vectors[path], "det_score": 0.9})
+
+            with mock.patch('face_comparison.analyze_face', side_effect=fake_analyze) as analyze:
+                first = compare_faces(image_paths, store)
+            self.assertEqual(analyze.call_count, 3)
+            self.assertEqual(len(store), 3)
+
+            with mock.patch('face_comparison.analyze_face') as analyze:
+                second = compare_faces(image_paths, store)
+            analyze.assert_not_called()
+            self.assertEqual(first[0], second[0])
+            self.assertAlmostEqual(first[1], second[1], places=5)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_search_gallery_ranks_enrolled_first(self):
+        """Test 1:N search returns the enrolled identity of the probe first"""
+        temp_dir = tempfile.mkdtemp()
+        try:
+            rng = np.random.default_rng(1)
+            gallery = rng.standard_normal((3, 512))
+            store = EmbeddingStore(os.path.join(temp_dir, "store"))
+            store.add_many(["alice", "bob", "carol"], gallery)
+
+            probe = (gallery[1] + 0.1 * rng.standard_normal(512)).tolist()
+            with mock.patch('face_comparison.analyze_face', return_value=json.dumps({"embedding": probe})):
+                matches = search_gallery("probe.jpg", store, top_k=3)
+            self.assertEqual([m["id"] for m in matches][0], "bob")
+            self.assertGreater(matches[0]["similarity"], matches[1]["similarity"])
+        finally:
+            shutil.rmtree(temp_dir)
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
\ No newline at end of file
@@ -0,0 +1,175 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from embedding_store import EmbeddingStore
+from gallery_sync import GallerySync, RecordedEventSource
+
+def person_created(person_id, ipfs_hash):
+    return {"event": "PersonCreated", "args": {"id": person_id, "ipfsHash": ipfs_hash}}
+
+def registered(wallet, ipfs_hash):
+    return {"event": "Registered", "args": {"wallet": wallet, "ipfsHash": ipfs_hash}}
+
+class TestGallerySync(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = EmbeddingStore(os.path.join(self.path, "store"))
+        self.checkpoint = os.path.join(self.path, "checkpoint.json")
+        rng = np.random.default_rng(0)
+        self.ipfs = {f"Qm{i}": {"embedding": rng.standard_normal(512).tolist()} for i in range(6)}
+        self.fetched = []
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def fetch_json(self, ipfs_hash):
+        self.fetched.append(ipfs_hash)
+        return self.ipfs[ipfs_hash]
+
+    def make_sync(self, source, **kwargs):
+        return GallerySync(source, self.store, self.checkpoint, start_block=1,
+                           fetch_json=self.fetch_json, **kwargs)
+
+    def test_initial_sync_and_resume(self):
+        """Test events are ingested once and syncing resumes from the checkpoint"""
+        source = RecordedEventSource([
+            {"number": 1, "hash": "0x01", "events": [person_created("a", "Qm0")]},
+            {"number": 2, "hash": "0x02", "events": []},
+            {"number": 3, "hash": "0x03", "events": [registered("0xABC", "Qm1")]},
+        ])
+        self.assertEqual(self.make_sync(source, batch_blocks=2).sync_once(), 2)
+        self.assertIn("person:a", self.store)
+        self.assertIn("wallet:0xabc", self.store)
+
+        source.blocks[4] = {"number": 4, "hash": "0x04", "events": [person_created("b", "Qm2")]}
+        resumed = self.make_sync(source)
+        self.assertEqual(resumed.sync_once(), 1)
+        self.assertEqual(self.fetched, ["Qm0", "Qm1", "Qm2"])
+        self.assertEqual(resumed.block, 4)
+
+    def test_reorg_rolls_back_orphaned_inserts(self):
+        """Test embeddings from orphaned blocks are removed and the new fork ingested"""
+        source = RecordedEventSource([
+            {"number": 1, "hash": "0x01", "events": [person_created("a", "Qm0")]},
+            {"number": 2, "hash": "0x02", "events": [person_created("b", "Qm1")]},
+            {"number": 3, "hash": "0x03", "events": [person_created("c", "Qm2")]},
+        ])
+        sync = self.make_sync(source)
+        sync.sync_once()
+
+        source.reorg(2, [
+            {"number": 2, "hash": "0x02b", "events": [person_created("d", "Qm3")]},
+        ])
+        sync.sync_once()
+        self.assertEqual(sorted(self.store.ids), ["person:a", "person:d"])
+        self.assertEqual(sync.block, 2)
+
+    def test_checkpoint_only_tracks_reorg_window(self):
+        """Test hashes and inserted ids are kept only for the last reorg_depth blocks"""
+        self.ipfs = {f"Qm{n}": {"embedding": [float(n + 1)] + [0.0] * 511} for n in range(1, 501)}
+        source = RecordedEventSource([
+            {"number": n, "hash": f"0x{n:x}", "events": [person_created(str(n), f"Qm{n}")] if n % 10 == 0 else []}
+            for n in range(1, 501)
+        ])
+        sync = self.make_sync(source, batch_blocks=200, reorg_depth=16)
+        sync.sync_once()
+        self.assertEqual(len(sync.hashes), 16)
+        self.assertTrue(all(n > 500 - 16 for n in sync.inserted))
+        self.assertEqual(sorted(sync.inserted), [490, 500])
+
+    def test_inline_embedding_and_failed_fetch(self):
+        """Test inline embeddings skip IPFS and failed fetches are retried on later syncs"""
+        source = RecordedEventSource([
+            {"number": 1, "hash": "0x01", "events": [
+                {"event": "PersonCreated", "args": {"id": "a", "embedding": [1.0] * 512}},
+                person_created("b", "QmLater"),
+            ]},
+            {"number": 2, "hash": "0x02", "events": []},
+        ])
+        self.assertEqual(self.make_sync(source).sync_once(), 1)
+        self.assertEqual(self.store.ids, ["person:a"])
+
+        # The gateway recovers; a fresh worker picks the failure up from the checkpoint
+        self.ipfs["QmLater"] = self.ipfs["Qm0"]
+        resumed = self.make_sync(source)
+        self.assertEqual(len(resumed.pending), 1)
+        self.assertEqual(resumed.sync_once(), 1)
+        self.assertEqual(self.store.ids, ["person:a", "person:b"])
+        self.assertEqual(resumed.pending, [])
+        self.assertEqual(self.fetched.count("QmLater"), 2, "One failed attempt, one retry")
+
+    def test_reorg_drops_pending_fetch(self):
+        """Test a pending fetch from an orphaned block is not retried"""
+        source = RecordedEventSource([
+            {"number": 1, "hash": "0x01", "events": []},
+            {"number": 2, "hash": "0x02", "events": [person_created("b", "QmLater")]},
+        ])
+        sync = self.make_sync(source)
+        sync.sync_once()
+        self.assertEqual(len(sync.pending), 1)
+
+        source.reorg(2, [{"number": 2, "hash": "0x02b", "events": []}])
+        self.ipfs["QmLater"] = self.ipfs["Qm0"]
+        self.assertEqual(sync.sync_once(), 0)
+        self.assertEqual(sync.pending, [])
+        self.assertEqual(self.store.ids, [])
+
+    def test_crash_before_checkpoint_then_reorg(self):
+        """Test ids committed just before a crash are still rolled back by a later reorg"""
+        source = RecordedEventSource([
+            {"number": 1, "hash": "0x01", "events": []},
+            {"number": 2, "hash": "0x02", "events": [person_created("b", "Qm1")]},
+            {"number": 3, "hash": "0x03", "events": []},
+        ])
+        crashing = self.make_sync(source)
+        crashing._save_checkpoint = lambda: (_ for _ in ()).throw(OSError("disk full"))
+        with self.assertRaises(OSError):
+            crashing.sync_once()
+        self.assertEqual(self.store.ids, ["person:b"])
+
+        resumed = self.make_sync(source)
+        self.assertEqual(resumed.sync_once(), 0)
+        self.assertEqual(resumed.inserted, {2: ["person:b"]})
+
+        source.reorg(2, [{"number": 2, "hash": "0x02b", "events": []}])
+        resumed.sync_once()
+        self.assertEqual(self.store.ids, [])
+
+    def test_block_hashes_come_from_events(self):
+        """Test hashes are taken from events, and a reorg during the read is caught"""
+        source = RecordedEventSource([
+            {"number": 1, "hash": "0x01", "events": [person_created("a", "Qm0")]},
+            {"number": 2, "hash": "0x02", "events": [person_created("b", "Qm1")]},
+            {"number": 3, "hash": "0x03", "events": []},
+        ])
+        lookups = []
+        block_hash = source.block_hash
+        source.block_hash = lambda number: lookups.append(number) or block_hash(number)
+        read_events = source.events
+
+        def events_then_reorg(from_block, to_block):
+            events = read_events(from_block, to_block)
+            if len(lookups) == 1:
+                # The chain reorgs right after the first read
+                source.reorg(2, [
+                    {"number": 2, "hash": "0x02b", "events": [person_created("c", "Qm2")]},
+                    {"number": 3, "hash": "0x03b", "events": []},
+                ])
+            return events
+        source.events = events_then_reorg
+
+        sync = self.make_sync(source)
+        sync.sync_once()
+        self.assertEqual(sorted(self.store.ids), ["person:a", "person:c"])
+        self.assertEqual(sync.hashes, {1: "0x01", 2: "0x02b", 3: "0x03b"})
+
+        lookups.clear()
+        source.blocks[4] = {"number": 4, "hash": "0x04", "events": [person_created("d", "Qm3")]}
+        source.blocks[5] = {"number": 5, "hash": "0x05", "events": [person_created("e", "Qm4")]}
+        sync.sync_once()
+        self.assertNotIn(4, lookups, "Blocks with events need no hash lookup")
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
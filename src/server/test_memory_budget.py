@@ -0,0 +1,100 @@
+import unittest
+import asyncio
+import cv2
+import numpy as np
+from memory_budget import (
+    MB, BodySizeLimitMiddleware, InFlightLimiter, check_image_pixels, image_dimensions,
+    per_image_bytes, slots_for_budget
+)
+
+async def echo_app(scope, receive, send):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": str(len(body)).encode()})
+
+def call(app, chunks, headers=(), path="/"):
+    messages = [{"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "path": path, "headers": list(headers)}
+    asyncio.run(app(scope, receive, send))
+    return sent[0]["status"], sent[1]["body"]
+
+class TestMemoryBudget(unittest.TestCase):
+    def test_slots_for_budget(self):
+        """Test the in-flight cap scales with the budget and never drops below one"""
+        buffer_bytes = 6 * MB
+        self.assertEqual(slots_for_budget(0, buffer_bytes), 1)
+        small = slots_for_budget(1024 * MB, buffer_bytes)
+        large = slots_for_budget(4096 * MB, buffer_bytes)
+        self.assertGreater(large, small)
+        self.assertLessEqual(large * per_image_bytes(buffer_bytes), 4096 * MB)
+
+    def test_limiter_caps_concurrency_and_reuses_buffers(self):
+        """Test no more than `slots` images run at once and buffers are recycled"""
+        created = []
+        limiter = InFlightLimiter(lambda: created.append(object()) or created[-1], slots=2)
+        active = 0
+        peak = 0
+        used = set()
+
+        async def work():
+            nonlocal active, peak
+            async with limiter.slot() as buffers:
+                used.add(id(buffers))
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.01)
+                active -= 1
+
+        async def main():
+            await asyncio.gather(*(work() for _ in range(10)))
+
+        asyncio.run(main())
+        self.assertEqual(peak, 2)
+        self.assertEqual(len(created), 2)
+        self.assertEqual(used, {id(b) for b in created})
+
+    def test_body_limit(self):
+        """Test uploads are rejected by declared length or mid-stream, and small ones pass"""
+        app = BodySizeLimitMiddleware(echo_app, max_bytes=100)
+        self.assertEqual(call(app, [b"x" * 50, b"x" * 50]), (200, b"100"))
+        self.assertEqual(call(app, [b"x" * 10], headers=[(b"content-length", b"500")])[0], 413)
+        self.assertEqual(call(app, [b"x" * 60, b"x" * 60, b"x" * 60])[0], 413)
+
+    def test_body_limit_scoped_to_paths(self):
+        """Test a path-scoped limit leaves other routes alone"""
+        app = BodySizeLimitMiddleware(echo_app, max_bytes=100, paths=["/analyze-face"])
+        self.assertEqual(call(app, [b"x" * 200], path="/analyze-face")[0], 413)
+        self.assertEqual(call(app, [b"x" * 200], path="/compare-embeddings"), (200, b"200"))
+
+    def test_image_dimensions_from_header(self):
+        """Test width and height are read from encoded headers without decoding"""
+        img = np.zeros((30, 70, 3), dtype=np.uint8)
+        for ext in (".jpg", ".png", ".webp", ".bmp"):
+            ok, encoded = cv2.imencode(ext, img)
+            self.assertTrue(ok)
+            self.assertEqual(image_dimensions(encoded.tobytes()), (70, 30), ext)
+        self.assertIsNone(image_dimensions(b"not an image"))
+        self.assertIsNone(image_dimensions(b"\x89PNG\r\n\x1a\n"), "Truncated headers are not trusted")
+
+    def test_pixel_limit(self):
+        """Test images over the decoded pixel budget are rejected"""
+        check_image_pixels(1000, 1000, max_pixels=1_000_000)
+        with self.assertRaises(ValueError):
+            check_image_pixels(40000, 25000, max_pixels=24_000_000)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)